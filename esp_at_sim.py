@@ -0,0 +1,330 @@
+import os
+import random
+import select
+import sys
+import threading
+import time
+from collections import deque
+
+from logparse import pop_flag, pop_opt
+from serial_capture import open_pty
+
+
+USAGE = """
+Usage:
+
+    esp_at_sim.py [-l latency_ms] [-j jitter_ms] [-e error_rate] [-r scan_rate] [-n scan_devices] [-s seed] [--busy]
+        simulate an ESP32 running ESP-AT BLE firmware on a pseudo-terminal and print its path;
+        point serial_ble_at (or serial_com) at it. Ctrl+C prints what was simulated and exits.
+
+    -l  milliseconds each command takes before its response (default 0).
+    -j  extra random milliseconds per command, uniform in [0, jitter] (default 0).
+    -e  fraction of commands answered with ERROR regardless of their arguments (default 0).
+    -r  scan adverts per second while AT+BLESCAN=1 runs (default 1000).
+    -n  number of distinct advertising addresses (default 100).
+    -s  random seed (default 0).
+    --busy  answer busy p... to commands arriving while another one runs, as the real firmware
+            does, instead of queueing them.
+
+    supported: AT, ATE0, ATE1, AT+RST, AT+GMR, AT+CMD?, AT+CWMODE, AT+BLEINIT, AT+BLEADDR,
+    AT+BLENAME, AT+BLEADVPARAM, AT+BLEADVDATAEX, AT+BLEADVSTART, AT+BLEADVSTOP,
+    AT+BLESCANPARAM, AT+BLESCAN.
+    adverts that do not fit the pty buffer are dropped and counted, like a UART overflowing.
+"""
+
+COMMANDS = ("AT", "ATE0", "ATE1", "AT+RST", "AT+GMR", "AT+CMD", "AT+CWMODE", "AT+BLEINIT", "AT+BLEADDR",
+            "AT+BLENAME", "AT+BLEADVPARAM", "AT+BLEADVDATAEX", "AT+BLEADVSTART", "AT+BLEADVSTOP",
+            "AT+BLESCANPARAM", "AT+BLESCAN")
+DEFAULTS = {
+    "CWMODE": "1",
+    "BLEINIT": "0",
+    "BLENAME": '"ESP-AT"',
+    "BLEADVPARAM": '32,32,0,0,7,0,0,"00:00:00:00:00:00"',
+    "BLEADVDATAEX": '"ESP-AT","A002","0102030405",1',
+    "BLESCANPARAM": "0,0,0,100,50",
+}
+GMR = ["AT version:3.2.0.0(simulated)", "SDK version:v5.0", "Bin version:2.4.0(WROOM-32)"]
+RESET_DELAY = 0.05
+SCAN_TICK = 0.01
+OUT_LIMIT = 64 * 1024
+POLL_INTERVAL = 0.2
+
+
+def mac(rng):
+    return ":".join("{:02x}".format(rng.randrange(256)) for _ in range(6))
+
+
+class EspAtSim:
+    """
+    ESP-AT BLE firmware stand-in on a pseudo-terminal, served by a background thread.
+    Commands are answered in order, each latency (+ up to jitter) seconds after the previous
+    one finished, with the echo, result lines and final OK or ERROR of the real firmware.
+    stats counts commands, injected errors, busy rejections, adverts sent and adverts dropped.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, scan_rate=1000, scan_devices=100, busy=False, seed=0):
+        if not 0 <= error_rate <= 1:
+            raise ValueError("error_rate must be in [0, 1]")
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.scan_rate = scan_rate
+        self.busy = busy
+        self.rng = random.Random(seed)
+        self.addr = mac(self.rng)
+        self.devices = [(mac(self.rng), "dev{:04d}".format(i), self.rng.randint(30, 95)) for i in range(scan_devices)]
+        self.stats = dict.fromkeys(("commands", "errors", "busy", "adverts", "dropped"), 0)
+        self.echo = True
+        self.state = dict(DEFAULTS)
+        self.master = self.slave = None
+        self.path = None
+        self._pending = deque()
+        self._last_due = 0.0
+        self._out = bytearray()
+        self._inbuf = b""
+        self._scan = None
+        self._reset_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.master, self.slave, self.path = open_pty()
+        os.set_blocking(self.master, False)
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def send(self, text: str):
+        self._out += text.encode()
+
+    def run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            wait = POLL_INTERVAL
+            if self._pending:
+                wait = min(wait, max(0, self._pending[0][0] - now))
+            if self._scan is not None:
+                wait = min(wait, SCAN_TICK)
+            if self._reset_at is not None:
+                wait = min(wait, max(0, self._reset_at - now))
+            r, w, _ = select.select([self.master], [self.master] if self._out else [], [], wait)
+            now = time.monotonic()
+            if r:
+                self.receive(now)
+            while self._pending and self._pending[0][0] <= now:
+                self.execute(self._pending.popleft()[1])
+            if self._reset_at is not None and self._reset_at <= now:
+                self._reset_at = None
+                self.state = dict(DEFAULTS)
+                self.send("\r\nready\r\n")
+            if self._scan is not None:
+                self.advertise(now)
+            if self._out:
+                self.flush()
+
+    def flush(self):
+        try:
+            n = os.write(self.master, self._out)
+        except BlockingIOError:
+            return
+        except OSError:
+            # the client closed the pty, keep the thread alive until stop()
+            self._out.clear()
+            return
+        del self._out[:n]
+
+    def receive(self, now):
+        try:
+            data = os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        *lines, self._inbuf = (self._inbuf + data).split(b"\n")
+        for line in lines:
+            line = line.decode(errors="replace").strip("\r")
+            if not line:
+                continue
+            if self.busy and (self._pending or self._last_due > now):
+                self.stats["busy"] += 1
+                self.send("busy p...\r\n")
+                continue
+            self._last_due = max(now, self._last_due) + self.latency + self.rng.uniform(0, self.jitter)
+            self._pending.append((self._last_due, line))
+
+    def execute(self, line):
+        self.stats["commands"] += 1
+        if self.echo:
+            self.send(line + "\r\n")
+        if self.rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            self.send("\r\nERROR\r\n")
+            return
+        try:
+            lines = self.handle(line)
+        except ValueError:
+            self.send("\r\nERROR\r\n")
+            return
+        for out in lines:
+            self.send(out + "\r\n")
+        self.send("\r\nOK\r\n")
+
+    def handle(self, line):
+        """Apply line to the state and return its result lines, raise ValueError to answer ERROR."""
+        name, op, args = line, "", ""
+        for sep in ("=", "?"):
+            if sep in line:
+                name, op, args = line.partition(sep)
+                break
+        if name not in COMMANDS:
+            raise ValueError(name)
+        key = name[3:]
+        if name in ("AT", "ATE0", "ATE1"):
+            if op:
+                raise ValueError(line)
+            self.echo = name != "ATE0"
+            return []
+        if name == "AT+RST":
+            self._scan = None
+            self._pending.clear()
+            self._reset_at = time.monotonic() + RESET_DELAY
+            return []
+        if name == "AT+GMR":
+            return list(GMR)
+        if name == "AT+CMD":
+            return ['+CMD:{},"{}",0,1,1,1'.format(i, c) for i, c in enumerate(COMMANDS)]
+        role = self.state["BLEINIT"]
+        if name.startswith("AT+BLE") and name != "AT+BLEINIT" and role == "0":
+            raise ValueError("BLE not initialized")
+        if op == "?":
+            if args:
+                raise ValueError(line)
+            if key == "BLEADDR":
+                return ['+BLEADDR:"{}"'.format(self.addr)]
+            if key not in self.state:
+                raise ValueError(line)
+            return ["+{}:{}".format(key, self.state[key])]
+        vals = args.split(",") if op else []
+        if name == "AT+CWMODE":
+            if len(vals) != 1 or vals[0] not in ("0", "1", "2", "3"):
+                raise ValueError(line)
+        elif name == "AT+BLEINIT":
+            if len(vals) != 1 or vals[0] not in ("0", "1", "2"):
+                raise ValueError(line)
+            self._scan = None
+            self.state.update({k: v for k, v in DEFAULTS.items() if k.startswith("BLE")})
+        elif name in ("AT+BLEADVPARAM", "AT+BLEADVDATAEX", "AT+BLEADVSTART", "AT+BLEADVSTOP"):
+            if role != "2":
+                raise ValueError("not a peripheral")
+            if name == "AT+BLEADVPARAM":
+                if len(vals) not in (5, 8):
+                    raise ValueError(line)
+                if len(vals) == 5:
+                    vals += self.state[key].split(",")[5:]
+            elif name == "AT+BLEADVDATAEX" and len(vals) != 4:
+                raise ValueError(line)
+            elif name in ("AT+BLEADVSTART", "AT+BLEADVSTOP"):
+                if op:
+                    raise ValueError(line)
+                return []
+        elif name in ("AT+BLESCANPARAM", "AT+BLESCAN"):
+            if role != "1":
+                raise ValueError("not a central")
+            if name == "AT+BLESCAN":
+                return self.scan(vals)
+            if len(vals) != 5:
+                raise ValueError(line)
+        elif name == "AT+BLENAME" and len(vals) != 1:
+            raise ValueError(line)
+        self.state[key] = ",".join(vals)
+        return []
+
+    def scan(self, vals):
+        """AT+BLESCAN=<enable>[,<interval>[,<filter_type>,<filter_param>]]"""
+        if not vals or vals[0] not in ("0", "1") or len(vals) not in (1, 2, 4):
+            raise ValueError("AT+BLESCAN")
+        if vals[0] == "0":
+            self._scan = None
+            return []
+        now = time.monotonic()
+        interval = int(vals[1]) if len(vals) > 1 else 0
+        devices = self.devices
+        if len(vals) == 4:
+            param = vals[3].strip('"')
+            col = {"1": 0, "2": 1}.get(vals[2])
+            if col is None:
+                raise ValueError("AT+BLESCAN")
+            devices = [d for d in devices if d[col] == param]
+        self._scan = {"devices": devices, "last": now, "until": now + interval if interval else None, "credit": 0.0}
+        return []
+
+    def advertise(self, now):
+        scan = self._scan
+        if scan["until"] is not None and now >= scan["until"]:
+            self._scan = None
+            return
+        scan["credit"] += (now - scan["last"]) * self.scan_rate
+        scan["last"] = now
+        n = int(scan["credit"])
+        scan["credit"] -= n
+        if not n or not scan["devices"]:
+            return
+        lines = []
+        for _ in range(n):
+            addr, name, rssi = self.rng.choice(scan["devices"])
+            adv = "020106{:02x}09{}".format(len(name) + 1, name.encode().hex())
+            lines.append('+BLESCAN:"{}",-{},{},,0\r\n'.format(addr, rssi + self.rng.randint(-5, 5), adv))
+        if len(self._out) >= OUT_LIMIT:
+            self.stats["dropped"] += n
+            return
+        self.stats["adverts"] += n
+        self.send("".join(lines))
+
+    def summary(self):
+        return ", ".join("{}={}".format(k, v) for k, v in self.stats.items())
+
+
+def main():
+    argv = list(sys.argv)
+    if "-h" in argv or "--help" in argv:
+        print(USAGE)
+        sys.exit(0)
+    busy = pop_flag(argv, "--busy")
+    sim = EspAtSim(
+        latency=float(pop_opt(argv, "-l", 0)) / 1000,
+        jitter=float(pop_opt(argv, "-j", 0)) / 1000,
+        error_rate=float(pop_opt(argv, "-e", 0)),
+        scan_rate=float(pop_opt(argv, "-r", 1000)),
+        scan_devices=int(pop_opt(argv, "-n", 100)),
+        busy=busy,
+        seed=int(pop_opt(argv, "-s", 0)),
+    )
+    if len(argv) > 1:
+        print(USAGE)
+        sys.exit(1)
+    with sim:
+        print(sim.path, flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    return sim.summary()
+
+
+if __name__ == "__main__":
+    result = main()
+    print(result)
@@ -1,27 +1,49 @@
-from collections import defaultdict
-import datetime
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+import contextlib
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import lzma
+import math
+import mmap
 import os
 import re
-import shutil
+import statistics
 import sys
-
-
-#TODO balancing algorithm for start end pairs
+import time
+import zlib
 
 
 USAGE = """
 Usage: 
 
     logparse.py -l <filename> <start_str> <end_str> <log_type>
-        -l  return latency time(s) in seconds, and line number of the search string.
+        -l  return latencies in milliseconds with statistics and a histogram,
+            and counts of starts and ends left unpaired.
 
     logparse.py -a <filename> <split_str> <start_str> <end_str> [log_type: default=serial]
-        -a  return average of latencies in seconds
-            split contents of <filename> with delimiter <split_str> into multiple files in a new directory.
-            this option helps accuracy when start and end log lines appear frequently in log.
+        -a  return statistics and a histogram of latencies in milliseconds
+            split contents of <filename> with delimiter <split_str> and average the latencies of each chunk.
+            only needed to reset pairing at known boundaries, -p and -t cover most logs.
+
+    logparse.py -r <dirname> <start_str> <end_str> <log_type> [-j <jobs>] [--timing]
+        -r recurses through directory <dirname> and returns latency statistics and a histogram in milliseconds.
+           -j parses files in a pool of <jobs> processes (0: one per CPU, default: 1).
+           --timing prints wall-clock seconds, latency count and path of each file to stderr.
+
+    logparse.py --follow <filename> <start_str> <end_str> <log_type>
+        --follow  keep reading <filename> as it grows, like tail -f, and print each latency in
+                  milliseconds with running statistics. handles rotation and truncation. Ctrl+C to stop.
 
-    logparse.py -r <dirname> <start_str> <end_str> <log_type>
-        -r recurses through directory <dirname> and returns average latency in seconds.
+    logparse.py -m <filename> <config>
+        -m  evaluate every named start/end metric and find string listed in <config> (JSON, or YAML
+            with PyYAML installed) in a single pass over <filename> and print one combined report.
+            see load_metrics for the config format.
 
     logparse.py -s <filename> <delimiter> <dirname>
         -s  split <filename> into multiple files in directory <dirname> 
@@ -31,47 +53,415 @@ Usage:
         -f find specified log line in file that contains a latency value usually in milliseconds
            returns logline index and latency if there is one.
 
+    gzip, xz and zstd compressed logs are decompressed on the fly for every flag except --follow.
+    binary captures written by `serial_com.py --capture` are read as cutecom logs with one
+    `[<date> <time> RX]` line per received line; pass log_type capture (or cutecom).
+
 ARGS:
 
     NOTE: each argument must be passed to command line between quotation marks,
           except for the flag. arguments need to be passed in order as specified in Usage.  
-    FLAGS: [-l | -a | -s | -f]
+    FLAGS: [-l | -a | -r | -m | --follow | -s | -f]
+    OPTIONS (-l, -a, -r, --follow):
+        -p <policy>: how each end is paired with a start, one of
+            nearest: closest preceding start, earlier unmatched starts are orphaned (default).
+            fifo: oldest unmatched start.
+            timeout: oldest unmatched start no more than -t seconds before the end.
+        -t <seconds>: drop starts older than <seconds> as orphans, implies -p timeout
+            (other -p policies are rejected with -t).
+    OPTIONS (-l, -r):
+        --cache: reuse timestamps indexed by earlier runs, stored in $LOGPARSE_CACHE
+            (default: ~/.cache/logparse). files that only grew are parsed from the old end.
     filename: absolute path to log file to parse.
     start_str: log line representing start timestamp.
     end_str: log line representing end timestamp.
-    log_type: should be one of ['logcat' | 'cutecom' | 'serial']
+    log_type: should be one of ['logcat' | 'cutecom' | 'serial' | 'capture']
         description: 
             logcat: logcat log file.
             cutecom: cutecom log file configured in cutecom GUI.
             serial: copy and paste cutecom logs from GUI to blank text file.
+            capture: binary capture written by serial_com.py --capture.
 """
                     
+TM_REGX = {
+    "logcat": re.compile(r"^[\[\s]*?[\d]{2}-[\d]{2}\s(?P<timestamp>[\d:.]+)[\]]*?"),
+    "serial": re.compile(r"\[(?P<timestamp>[\d]{2}:[\d]{2}:[\d]{2}:[\d]{3})\]|(?P=timestamp)\s\[(?P<date>[\d]{4}-[\d]{2}-[\d]{2})\s(?P<time>[\d]{2}:[\d]{2}:[\d]{2}\.[\d]{3})\s[^\]]*\]"),
+    "cutecom": re.compile(r"\[(?P<date>[\d]{4}-[\d]{2}-[\d]{2})\s(?P<timestamp>[\d]{2}:[\d]{2}:[\d]{2}\.[\d]{3})\s[^\]]*\]"),
+}
+TM_REGX["minicom"] = TM_REGX["cutecom"]
+TM_REGX["capture"] = TM_REGX["cutecom"]
+REGEX_CHARS = frozenset(".^$*+?{}[]\\|()")
+LATENCY_REGX = re.compile(r"latency=[\d\w]*")
+MULTI_SEARCH_MIN = 4
+BLOCK_SIZE = 1 << 20
+PAIR_POLICIES = ("nearest", "fifo", "timeout")
+CACHE_DIR = os.environ.get("LOGPARSE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "logparse"))
+CACHE_VERSION = 2
+CACHE_CHECK_SIZE = 4096
+DAY_MS = 24 * 60 * 60 * 1000
+HIST_BINS = 10
+HIST_WIDTH = 40
+FOLLOW_INTERVAL = 0.5
+SPLIT_OVERLAP = 4096
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"SERCAP": "capture",
+}
+
+
+def get_tm_regx(log_type):
+    try:
+        return TM_REGX[log_type]
+    except KeyError:
+        raise ValueError("log_type must be one of {}".format(sorted(TM_REGX)))
+
+
+def compile_search(search_str):
+    """
+    Return a line predicate for search_str.
+    Strings without regex syntax are matched with a plain substring test,
+    anything else is compiled once and matched with re.search.
+    """
+    if REGEX_CHARS.isdisjoint(search_str):
+        return lambda line: search_str in line
+    return re.compile(search_str).search
+
+
+def compile_prefilter(search_strs):
+    """
+    Return one predicate telling whether a line may contain any of search_strs.
+    All literal strings are folded into a single alternation so a line is scanned once
+    by the regex engine however many literals there are; regex strings are checked as is.
+    """
+    literals = [s for s in search_strs if REGEX_CHARS.isdisjoint(s)]
+    regexes = [compile_search(s) for s in search_strs if not REGEX_CHARS.isdisjoint(s)]
+    any_literal = re.compile("|".join(map(re.escape, sorted(literals, key=len, reverse=True)))).search
+    if not literals:
+        return lambda line: any(found(line) for found in regexes)
+    if not regexes:
+        return any_literal
+    return lambda line: any_literal(line) is not None or any(found(line) for found in regexes)
+
+
+def iter_hits(lines, search_strs, log_type="cutecom", lineno=0):
+    """
+    Yield (line number, timestamp, line, matched search strings) for every timestamped line
+    containing at least one of search_strs. Lines are rejected with the search predicates,
+    or a single combined prefilter when there are many strings, before the timestamp regex runs.
+    Line numbers continue from lineno.
+    """
+    tm_match = get_tm_regx(log_type).match
+    searches = [(s, compile_search(s)) for s in dict.fromkeys(search_strs)]
+    prefilter = compile_prefilter([s for s, _ in searches]) if len(searches) >= MULTI_SEARCH_MIN else None
+    for i, line in enumerate(lines, start=lineno + 1):
+        if prefilter is None:
+            for _, found in searches:
+                if found(line):
+                    break
+            else:
+                continue
+        elif not prefilter(line):
+            continue
+        m = tm_match(line[3:] if line.startswith("-->") else line)
+        if m is None or m.group("timestamp") is None:
+            continue
+        hits = [s for s, found in searches if found(line)]
+        if hits:
+            yield i, m.group("timestamp"), line, hits
+
+
+def scan_lines(lines, search_strs, log_type="cutecom", lineno=0):
+    """
+    Collect timestamps for every string in search_strs from an iterable of lines.
+    Line numbers continue from lineno.
+    Returns a dict of search string -> list of (timestamp, line number).
+    """
+    events = {s: [] for s in search_strs}
+    for i, tm, _, hits in iter_hits(lines, search_strs, log_type, lineno):
+        for s in hits:
+            events[s].append((tm, i))
+    return events
+
+
+def log_compression(filename):
+    """Return "gzip", "xz", "zstd" or "capture" from the magic bytes of filename, or None for plain text."""
+    with open(filename, "rb") as fh:
+        head = fh.read(max(len(magic) for magic in COMPRESSION_MAGIC))
+    for magic, fmt in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def open_zstd(filename):
+    try:
+        from compression import zstd
+        return zstd.open(filename, "rb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("reading zstd logs requires Python 3.14+ or the zstandard package")
+    reader = zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True)
+    return io.BufferedReader(reader)
+
+
+def open_log(filename, mode="r"):
+    """
+    Open filename as latin-1 text (mode "r") or bytes (mode "rb").
+    gzip, xz and zstd files are recognised by their magic bytes and decompressed as a stream,
+    serial captures are rendered as cutecom lines by serial_capture.
+    """
+    fmt = log_compression(filename)
+    if fmt == "gzip":
+        fh = gzip.open(filename, "rb")
+    elif fmt == "xz":
+        fh = lzma.open(filename, "rb")
+    elif fmt == "zstd":
+        fh = open_zstd(filename)
+    elif fmt == "capture":
+        from serial_capture import open_capture_text
+        fh = open_capture_text(filename)
+    else:
+        fh = open(filename, "rb")
+    if mode == "rb":
+        return fh
+    return io.TextIOWrapper(fh, encoding="latin-1")
+
+
+def scan_events(filename, search_strs, log_type="cutecom"):
+    """Read filename once and collect timestamps for every string in search_strs."""
+    with open_log(filename) as fh:
+        return scan_lines(fh, search_strs, log_type)
+
+
 def get_logstr_tms(filename, search_str, log_type="cutecom"):
-    tm = None
-    tms = []
-    if log_type == "logcat":
-        tm_regx = re.compile(r"^[\[\s]*?[\d]{2}-[\d]{2}\s(?P<timestamp>[\d:.]+)[\]]*?")
-    elif log_type == "serial":
-        tm_regx = re.compile(r"\[(?P<timestamp>[\d]{2}:[\d]{2}:[\d]{2}:[\d]{3})\]|(?P=timestamp)\s\[(?P<date>[\d]{4}-[\d]{2}-[\d]{2})\s(?P<time>[\d]{2}:[\d]{2}:[\d]{2}\.[\d]{3})\s[^\]]*\]")
-    elif log_type in {"cutecom", "minicom"}:
-        tm_regx = re.compile(r"\[(?P<date>[\d]{4}-[\d]{2}-[\d]{2})\s(?P<timestamp>[\d]{2}:[\d]{2}:[\d]{2}\.[\d]{3})\s[^\]]*\]")
-    with open(filename, "r", encoding="latin-1") as fh:
-        for i, line in enumerate(fh, start=1):
-            for m in re.findall(search_str, line):
-                if re.match(r"^-->", line):
-                    line = re.sub(r"^-->", "", line) 
-                if tm_regx.match(line):
-                    try:
-                        tm = tm_regx.match(line).group("timestamp")
-                    except AttributeError as err:
-                        print(err)
-                    if tm != None: 
-                        tms.append((tm, i))
-                    else:
-                        continue
-                else:
-                    continue
-    return tms
+    return scan_events(filename, [search_str], log_type)[search_str]
+
+
+def scan_start_end(filename, start_str, end_str, log_type="cutecom", cache=False):
+    """Single pass over filename returning (start events, end events)."""
+    if cache:
+        events = cached_scan_events(filename, [start_str, end_str], log_type)
+    else:
+        events = scan_events(filename, [start_str, end_str], log_type)
+    return events[start_str], events[end_str]
+
+
+def index_path(filename):
+    digest = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{digest}.json")
+
+
+def load_index(filename):
+    try:
+        with open(index_path(filename), "r") as fh:
+            index = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != CACHE_VERSION or index.get("path") != os.path.abspath(filename):
+        return None
+    return index
+
+
+def save_index(filename, index):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = index_path(filename)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fh:
+        # json.dumps runs the C encoder, json.dump to a file the pure Python one
+        fh.write(json.dumps(index, separators=(",", ":")))
+    os.replace(tmp, path)
+
+
+def count_lines(buf, start, end):
+    n = 0
+    for pos in range(start, end, BLOCK_SIZE):
+        n += buf[pos:min(pos + BLOCK_SIZE, end)].count(b"\n")
+    return n
+
+
+def cached_scan_events(filename, search_strs, log_type="cutecom"):
+    """
+    scan_events backed by an on-disk index in CACHE_DIR (env LOGPARSE_CACHE).
+    The index keeps the events of every search string and log_type requested so far,
+    each log_type with the offset and line count it has been scanned up to, keyed by
+    path, size and mtime. When the file only grew and the bytes before the old end are
+    unchanged, just the tail after a log_type's offset is parsed; any other change drops
+    the whole index, and a search string not in the index rescans the file for its log_type.
+    Compressed logs are treated as archives: any change drops their index, and only
+    search strings missing from it are scanned.
+    """
+    if log_compression(filename) is not None:
+        return cached_scan_compressed(filename, search_strs, log_type)
+    mtime_ns = os.stat(filename).st_mtime_ns
+    index = load_index(filename)
+    with map_log(filename) as mm:
+        size = len(mm)
+        end = mm.rfind(b"\n") + 1
+        if index is not None and (index["size"], index["mtime_ns"]) != (size, mtime_ns):
+            old_end = index["end"]
+            check = zlib.crc32(mm[max(0, old_end - CACHE_CHECK_SIZE):old_end])
+            if size <= index["size"] or check != index["check"]:
+                index = None
+        changed = index is None or (index["size"], index["mtime_ns"]) != (size, mtime_ns)
+        if index is None:
+            index = {"version": CACHE_VERSION, "path": os.path.abspath(filename), "end": 0,
+                     "scanned": {}, "events": {}}
+        cached = index["events"].setdefault(log_type, {})
+        scanned = index["scanned"].setdefault(log_type, [0, 0])
+        search_strs = list(dict.fromkeys(search_strs))
+        keys = list(cached) + [s for s in search_strs if s not in cached]
+        if len(keys) > len(cached):
+            scanned[:] = [0, 0]
+            cached.clear()
+            changed = True
+        start, start_lines = scanned
+        changed |= start != end
+        lines = start_lines + count_lines(mm, start, end)
+        events = scan_lines(iter_lines(mm, start, end), keys, log_type, start_lines)
+        for s, found in events.items():
+            cached.setdefault(s, []).extend(found)
+        partial = scan_lines(iter_lines(mm, end, size), search_strs, log_type, lines)
+        scanned[:] = [end, lines]
+        index.update(size=size, mtime_ns=mtime_ns, end=end,
+                     check=zlib.crc32(mm[max(0, end - CACHE_CHECK_SIZE):end]))
+    if changed:
+        save_index(filename, index)
+    return {s: [tuple(e) for e in cached[s]] + partial[s] for s in search_strs}
+
+
+def cached_scan_compressed(filename, search_strs, log_type="cutecom"):
+    st = os.stat(filename)
+    index = load_index(filename)
+    if index is not None and (index["size"], index["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+        index = None
+    if index is None:
+        index = {"version": CACHE_VERSION, "path": os.path.abspath(filename), "size": st.st_size,
+                 "mtime_ns": st.st_mtime_ns, "end": 0, "check": None, "scanned": {}, "events": {}}
+    cached = index["events"].setdefault(log_type, {})
+    missing = [s for s in dict.fromkeys(search_strs) if s not in cached]
+    if missing:
+        cached.update(scan_events(filename, missing, log_type))
+        save_index(filename, index)
+    return {s: [tuple(e) for e in cached[s]] for s in search_strs}
+
+
+@contextlib.contextmanager
+def map_log(filename):
+    """Map filename read-only; empty files map to b"" since mmap rejects them."""
+    with open(filename, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def chunk_bounds(buf, split_str):
+    """Yield (start, end) byte offsets of the chunks of buf separated by split_str."""
+    start = 0
+    for m in re.finditer(split_str.encode("latin-1"), buf):
+        yield start, m.start()
+        start = m.end()
+    yield start, len(buf)
+
+
+def stream_chunk_parts(fh, split_str):
+    """
+    Yield (data, sep) pieces of the chunks of a binary stream separated by split_str:
+    sep is None while the chunk goes on, or the length of the delimiter that ends it
+    (0 for the last chunk). Only one read block and SPLIT_OVERLAP bytes are held in
+    memory; a delimiter match is accepted once data follows it.
+    """
+    pattern = re.compile(split_str.encode("latin-1"))
+    buf = bytearray()
+    while True:
+        data = fh.read(BLOCK_SIZE)
+        buf += data
+        pos = 0
+        for m in pattern.finditer(buf):
+            if data and m.end() >= len(buf):
+                break
+            yield bytes(buf[pos:m.start()]), m.end() - m.start()
+            pos = m.end()
+        if not data:
+            yield bytes(buf[pos:]), 0
+            return
+        # keep the tail a delimiter may still start in, the rest of the chunk goes out now
+        keep = max(pos, len(buf) - SPLIT_OVERLAP)
+        if keep > pos:
+            yield bytes(buf[pos:keep]), None
+        del buf[:keep]
+
+
+def stream_chunks(fh, split_str):
+    """
+    Yield (start, end, chunk) for the chunks of a binary stream separated by split_str,
+    with start and end as offsets into the stream. Only the current chunk and one read
+    block are held in memory.
+    """
+    parts = []
+    start = pos = 0
+    for data, sep in stream_chunk_parts(fh, split_str):
+        parts.append(data)
+        pos += len(data)
+        if sep is not None:
+            yield start, pos, b"".join(parts)
+            parts = []
+            pos += sep
+            start = pos
+
+
+def iter_chunk_regions(filename, split_str):
+    """
+    Yield (buf, start, end) for every chunk of filename separated by split_str.
+    Plain files are mapped and yield offsets into the map, compressed files are
+    decompressed as a stream and yield one chunk at a time.
+    """
+    if log_compression(filename) is None:
+        with map_log(filename) as mm:
+            for start, end in chunk_bounds(mm, split_str):
+                yield mm, start, end
+    else:
+        with open_log(filename, "rb") as fh:
+            for _, _, chunk in stream_chunks(fh, split_str):
+                yield chunk, 0, len(chunk)
+
+
+def iter_chunk_bounds(filename, split_str):
+    """
+    Yield (start, end) byte offsets of the chunks of filename separated by split_str.
+    The delimiter is searched in the mapped file, so nothing is read into memory;
+    compressed files are searched as they decompress and their offsets refer to
+    the decompressed stream.
+    """
+    if log_compression(filename) is None:
+        with map_log(filename) as mm:
+            yield from chunk_bounds(mm, split_str)
+    else:
+        with open_log(filename, "rb") as fh:
+            start = pos = 0
+            for data, sep in stream_chunk_parts(fh, split_str):
+                pos += len(data)
+                if sep is not None:
+                    yield start, pos
+                    pos += sep
+                    start = pos
+
+
+def iter_lines(buf, start=0, end=None):
+    """Yield the latin-1 decoded lines of buf[start:end] one at a time."""
+    if end is None:
+        end = len(buf)
+    while start < end:
+        nl = buf.find(b"\n", start, end)
+        stop = end if nl < 0 else nl + 1
+        yield buf[start:stop].decode("latin-1")
+        start = stop
 
 
 def split_log(filename, split_str, dirname=None):
@@ -80,30 +470,55 @@ def split_log(filename, split_str, dirname=None):
     if not os.path.exists(dirname):
         os.mkdir(dirname)
     fname = filename.split("/")[-1].split(".")[0]
-    i = 0
-    for chunk in get_chunks(filename, split_str):
-        with open(f"{dirname}/{fname}_{i}.log", "w") as fh:
-            fh.write(str(chunk))
-        i += 1
+    if log_compression(filename) is not None:
+        split_stream(filename, split_str, f"{dirname}/{fname}")
+        return dirname
+    for i, (buf, start, end) in enumerate(iter_chunk_regions(filename, split_str)):
+        with open(f"{dirname}/{fname}_{i}.log", "wb") as fh:
+            for pos in range(start, end, BLOCK_SIZE):
+                fh.write(buf[pos:min(pos + BLOCK_SIZE, end)])
     return dirname
 
 
+def split_stream(filename, split_str, prefix):
+    """Write the chunks of a compressed log to <prefix>_<i>.log as they decompress."""
+    i = 0
+    out = None
+    with open_log(filename, "rb") as fh:
+        try:
+            for data, sep in stream_chunk_parts(fh, split_str):
+                if out is None:
+                    out = open(f"{prefix}_{i}.log", "wb")
+                out.write(data)
+                if sep is not None:
+                    out.close()
+                    out = None
+                    i += 1
+        finally:
+            if out is not None:
+                out.close()
+
+
 def get_chunks(filename, s):
-    with open(filename, "r", encoding="latin-1") as fh:
-        chunks = re.split(s, fh.read())
-        for chunk in chunks:
-            yield chunk 
+    for buf, start, end in iter_chunk_regions(filename, s):
+        yield buf[start:end].decode("latin-1")
+
+
+def chunk_latencies(filename, split_str, start_str, end_str, log_type="cutecom", policy="nearest", timeout=None):
+    """
+    Yield an array of latencies in milliseconds for every chunk of filename separated by split_str.
+    Chunks are parsed straight from the mapped file instead of being split to disk first.
+    """
+    for buf, start, end in iter_chunk_regions(filename, split_str):
+        events = scan_lines(iter_lines(buf, start, end), [start_str, end_str], log_type)
+        matcher = EventMatcher(policy, timeout)
+        yield array("q", time_diffs_ms(events[start_str], events[end_str], log_type, matcher))
 
 
 def parse_log_datetime_latency(filename, search_str, log_type="cutecom"):
     tm_dict = defaultdict(dict)
-    if log_type in {"cutecom", "minicom"}:
-        tm_regx = re.compile(r"\[(?P<date>[\d]{4}-[\d]{2}-[\d]{2})\s(?P<timestamp>[\d]{2}:[\d]{2}:[\d]{2}\.[\d]{3})\s[^\]]*\]")
-    elif log_type == "serial":
-        tm_regx = re.compile(r"\[(?P<timestamp>[\d]{2}:[\d]{2}:[\d]{2}:[\d]{3})\]|(?P=timestamp)\s\[(?P<date>[\d]{4}-[\d]{2}-[\d]{2})\s(?P<time>[\d]{2}:[\d]{2}:[\d]{2}\.[\d]{3})\s[^\]]*\]")
-    elif log_type == "logcat":
-        tm_regx = re.compile(r"^[\[\s]*?[\d]{2}-[\d]{2}\s(?P<timestamp>[\d:.]+)[\]]*?\s")
-    with open(filename, "r", encoding="latin-1") as fh:
+    tm_regx = get_tm_regx(log_type)
+    with open_log(filename) as fh:
         for i, line in enumerate(fh, start=1):
             for m in re.findall(search_str, line):
                 try:
@@ -118,88 +533,445 @@ def parse_log_datetime_latency(filename, search_str, log_type="cutecom"):
     return tm_dict
 
 
-def log_time_diff_gen(filename, start_str, end_str, log_type="cutecom"):
-    first_list = get_logstr_tms(filename, start_str, log_type)
-    second_list = get_logstr_tms(filename, end_str, log_type)
-    for first, second in zip(first_list, second_list):
-        tm1 = first[0].split(":")
-        tm2 = second[0].split(":")
-        if log_type != "serial":
-            sec1, msec1 = tm1[-1].split(".")
-            sec2, msec2 = tm2[-1].split(".")
+def load_metrics(filename):
+    """
+    Load a metric config from JSON, or YAML when filename ends in .yaml/.yml and PyYAML is installed:
+        {
+            "log_type": "cutecom",
+            "policy": "nearest",
+            "timeout": null,
+            "metrics": {"<name>": {"start": "<start_str>", "end": "<end_str>", "policy": ..., "timeout": ...}},
+            "find": ["<search_str>"]
+        }
+    policy and timeout are optional, per metric or for all of them.
+    """
+    with open(filename, "r") as fh:
+        if filename.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("YAML metric configs require PyYAML, use a JSON config instead")
+            config = yaml.safe_load(fh)
         else:
-            sec1, msec1 = tm1[-2], tm1[-1]
-            sec2, msec2 = tm2[-2], tm2[-1]
-        t1 = datetime.time(int(tm1[0]), int(tm1[1]), int(sec1), int(msec1))
-        t2 = datetime.time(int(tm2[0]), int(tm2[1]), int(sec2), int(msec2))
-        td1 = datetime.timedelta(hours=t1.hour, minutes=t1.minute, seconds=t1.second, microseconds=t1.microsecond).total_seconds()
-        td2 = datetime.timedelta(hours=t2.hour, minutes=t2.minute, seconds=t2.second, microseconds=t2.microsecond).total_seconds()
-        diff = td2 - td1
-        yield diff
-
-
-def recursive_latency(dirname, start_str, end_str, log_type):
-    times = []
+            config = json.load(fh)
+    metrics = config.setdefault("metrics", {})
+    if not isinstance(metrics, dict) or not metrics and not config.get("find"):
+        raise ValueError("metric config needs a 'metrics' mapping of name -> {start, end} or a 'find' list")
+    for name, metric in metrics.items():
+        if not {"start", "end"} <= set(metric):
+            raise ValueError("metric {} needs 'start' and 'end' search strings".format(name))
+    return config
+
+
+def metric_latencies(filename, config):
+    """
+    Evaluate every metric and find string of config in a single scan of filename.
+    Returns ({name: (array of latencies in ms, matcher)}, {find string: {line: timestamp or
+    {"Timestamp", "Latency"}}}), the latter in the format of parse_log_datetime_latency.
+    """
+    log_type = config.get("log_type", "cutecom")
+    metrics = config["metrics"]
+    finds = config.get("find", [])
+    search_strs = [s for m in metrics.values() for s in (m["start"], m["end"])] + finds
+    events = {s: [] for s in search_strs}
+    found = {s: {} for s in finds}
+    with open_log(filename) as fh:
+        for i, tm, line, hits in iter_hits(fh, search_strs, log_type):
+            for s in hits:
+                events[s].append((tm, i))
+                if s in found:
+                    lat = LATENCY_REGX.findall(line)
+                    found[s][f"line: {i}"] = {"Timestamp": tm, "Latency": lat} if lat else tm
+    results = {}
+    for name, m in metrics.items():
+        matcher = EventMatcher(m.get("policy", config.get("policy", "nearest")), m.get("timeout", config.get("timeout")))
+        results[name] = (array("q", time_diffs_ms(events[m["start"]], events[m["end"]], log_type, matcher)), matcher)
+    return results, found
+
+
+def format_metrics(results, found):
+    sections = []
+    for name, (times, matcher) in results.items():
+        sections.append("\n".join([f"== {name} ==", format_report(times),
+                                   f"Orphaned starts: {matcher.orphan_starts}  Orphaned ends: {matcher.orphan_ends}"]))
+    for search_str, lines in found.items():
+        entries = [f"{line}: {tm}" for line, tm in lines.items()]
+        sections.append("\n".join([f"== find: {search_str} ==", f"count: {len(lines)}"] + entries))
+    return "\n\n".join(sections)
+
+
+class EventMatcher:
+    """
+    Streaming start/end pairing, fed with (milliseconds, line number) events in log order.
+    Policies:
+        nearest: an end pairs with the closest preceding start, earlier unmatched starts are orphaned.
+        fifo:    an end pairs with the oldest unmatched start.
+        timeout: like fifo, but starts more than `timeout` seconds older than the end are orphaned.
+                 ages wrap at midnight like the latencies.
+    Ends without a start to pair with are counted in orphan_ends.
+    """
+
+    def __init__(self, policy="nearest", timeout=None):
+        if policy not in PAIR_POLICIES:
+            raise ValueError("policy must be one of {}".format(PAIR_POLICIES))
+        if policy == "timeout" and timeout is None:
+            raise ValueError("timeout policy requires a timeout in seconds")
+        self.policy = policy
+        self.timeout = timeout
+        self.timeout_ms = None if timeout is None else timeout * 1000
+        self.pending = deque()
+        self.orphan_starts = 0
+        self.orphan_ends = 0
+
+    def start(self, event):
+        if self.policy == "nearest" and self.pending:
+            self.pending.pop()
+            self.orphan_starts += 1
+        self.pending.append(event)
+
+    def end(self, event):
+        """Return the (start, end) pair closed by event, or None if it is an orphan."""
+        if self.policy == "timeout":
+            while self.pending and (event[0] - self.pending[0][0]) % DAY_MS > self.timeout_ms:
+                self.pending.popleft()
+                self.orphan_starts += 1
+        if not self.pending:
+            self.orphan_ends += 1
+            return None
+        return self.pending.popleft(), event
+
+    def finish(self):
+        """Count starts still waiting for an end as orphans."""
+        self.orphan_starts += len(self.pending)
+        self.pending.clear()
+
+
+def pair_events(first_list, second_list, matcher, finish=True):
+    """
+    Yield (start, end) pairs from start and end events sorted by line number.
+    Both lists are merged in a single pass; an end on the same line as a start
+    is handled first so a line never closes itself. With finish=False starts still
+    pending stay in the matcher for events fed later.
+    """
+    merged = heapq.merge(((e[1], 0, e) for e in second_list), ((e[1], 1, e) for e in first_list))
+    for _, is_start, event in merged:
+        if is_start:
+            matcher.start(event)
+        else:
+            pair = matcher.end(event)
+            if pair is not None:
+                yield pair
+    if finish:
+        matcher.finish()
+
+
+def tm_to_ms(tm, log_type="cutecom"):
+    """Convert a timestamp string to integer milliseconds since midnight."""
+    if log_type == "serial":
+        h, m, sec, ms = tm.split(":")
+    else:
+        h, m, sec = tm.split(":")
+        sec, _, frac = sec.partition(".")
+        ms = (frac + "000")[:3]
+    return ((int(h) * 60 + int(m)) * 60 + int(sec)) * 1000 + int(ms)
+
+
+def log_time_diff_gen(filename, start_str, end_str, log_type="cutecom", matcher=None, cache=False):
+    first_list, second_list = scan_start_end(filename, start_str, end_str, log_type, cache)
+    return time_diffs(first_list, second_list, log_type, matcher)
+
+
+def time_diffs(first_list, second_list, log_type="cutecom", matcher=None):
+    for diff in time_diffs_ms(first_list, second_list, log_type, matcher):
+        yield diff / 1000
+
+
+def time_diffs_ms(first_list, second_list, log_type="cutecom", matcher=None, finish=True):
+    """
+    Yield the latency in milliseconds of every start/end pair.
+    An end stamped earlier than its start crossed midnight and gets a day added.
+    """
+    if matcher is None:
+        matcher = EventMatcher()
+    starts = ((tm_to_ms(tm, log_type), i) for tm, i in first_list)
+    ends = ((tm_to_ms(tm, log_type), i) for tm, i in second_list)
+    for first, second in pair_events(starts, ends, matcher, finish):
+        yield (second[0] - first[0]) % DAY_MS
+
+
+def latency_stats(values):
+    """Return count, min, max, mean, p50, p95, p99 and stddev of latencies in milliseconds."""
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return {"count": 0}
+    mean = sum(values) / n
+
+    def pct(p):
+        return values[max(0, math.ceil(p / 100 * n) - 1)]
+
+    return {
+        "count": n,
+        "min": values[0],
+        "max": values[-1],
+        "mean": mean,
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+        "stddev": statistics.pstdev(values, mean),
+    }
+
+
+def histogram(values, bins=HIST_BINS):
+    """Return [(low, high, count)] for equal width bins spanning values."""
+    if len(values) == 0:
+        return []
+    lo, hi = min(values), max(values)
+    width = max(1, math.ceil((hi - lo + 1) / bins))
+    counts = [0] * bins
+    for v in values:
+        counts[min(bins - 1, (v - lo) // width)] += 1
+    return [(lo + i * width, lo + (i + 1) * width, c) for i, c in enumerate(counts)]
+
+
+def format_report(values, bins=HIST_BINS, unit="ms"):
+    """Render latency statistics and a text histogram for integer latencies in unit (milliseconds by default)."""
+    stats = latency_stats(values)
+    if stats["count"] == 0:
+        return "No start/end pairs found."
+    u = unit
+    lines = [f"count: {stats['count']}  min: {stats['min']} {u}  max: {stats['max']} {u}  "
+             f"mean: {stats['mean']:.3f} {u}  stddev: {stats['stddev']:.3f} {u}",
+             f"p50: {stats['p50']} {u}  p95: {stats['p95']} {u}  p99: {stats['p99']} {u}"]
+    hist = histogram(values, bins)
+    peak = max(c for _, _, c in hist)
+    for low, high, count in hist:
+        bar = "#" * math.ceil(count / peak * HIST_WIDTH)
+        lines.append(f"{low:>9} - {high:<9} {u} | {bar} {count}")
+    return "\n".join(lines)
+
+
+def list_logs(dirname):
     paths = []
     for path, _, filenames in os.walk(dirname):
         for filename in filenames:
             paths.append(os.path.join(path, filename))
-    for filename in paths:
-        times.append([time for time in log_time_diff_gen(filename, start_str, end_str, log_type) if time > 0])
-    return times
+    return sorted(paths)
+
+
+class RunningStats:
+    """Count, min, max, mean and stddev of latencies updated one value at a time (Welford)."""
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self._m2 / self.count) if self.count else 0.0
+
+    def __str__(self):
+        if self.count == 0:
+            return "count: 0"
+        return (f"count: {self.count}  min: {self.min} ms  max: {self.max} ms  "
+                f"mean: {self.mean:.3f} ms  stddev: {self.stddev:.3f} ms")
+
+
+def follow_latency(filename, start_str, end_str, log_type="cutecom", matcher=None, stats=None, interval=FOLLOW_INTERVAL):
+    """
+    Follow a growing log like `tail -f` and yield (latency in ms, stats) whenever a pair completes.
+    Only bytes appended since the last poll are read; an unterminated last line waits for its newline.
+    When the path is replaced (rotation) the rest of the old file is read before the new one is opened,
+    and a file that shrinks (truncation) is read again from the beginning. Pending starts carry over.
+    """
+    if matcher is None:
+        matcher = EventMatcher()
+    if stats is None:
+        stats = RunningStats()
+    fh = None
+    ino = offset = lineno = 0
+    partial = b""
+
+    def feed(buf):
+        nonlocal lineno
+        lines = list(iter_lines(buf))
+        events = scan_lines(lines, [start_str, end_str], log_type, lineno)
+        lineno += len(lines)
+        for latency in time_diffs_ms(events[start_str], events[end_str], log_type, matcher, finish=False):
+            stats.add(latency)
+            yield latency, stats
+
+    try:
+        while True:
+            try:
+                st = os.stat(filename)
+            except FileNotFoundError:
+                st = None
+            if fh is not None and (st is None or st.st_ino != ino or st.st_size < offset):
+                if st is None or st.st_ino != ino:
+                    data = fh.read()
+                    yield from feed(partial + data)
+                fh.close()
+                fh = None
+            if fh is None:
+                if st is None:
+                    time.sleep(interval)
+                    continue
+                fh = open(filename, "rb")
+                ino = os.fstat(fh.fileno()).st_ino
+                offset = lineno = 0
+                partial = b""
+            data = fh.read(BLOCK_SIZE)
+            if not data:
+                time.sleep(interval)
+                continue
+            offset += len(data)
+            buf = partial + data
+            end = buf.rfind(b"\n") + 1
+            partial = buf[end:]
+            yield from feed(buf[:end])
+    finally:
+        if fh is not None:
+            fh.close()
+
+
+def file_latency(filename, start_str, end_str, log_type, policy="nearest", timeout=None, cache=False):
+    """Return (filename, array of latencies in milliseconds, wall-clock seconds) for a single log."""
+    t0 = time.perf_counter()
+    matcher = EventMatcher(policy, timeout)
+    first_list, second_list = scan_start_end(filename, start_str, end_str, log_type, cache)
+    times = array("q", time_diffs_ms(first_list, second_list, log_type, matcher))
+    return filename, times, time.perf_counter() - t0
+
+
+def recursive_latency_timed(dirname, start_str, end_str, log_type, jobs=1, policy="nearest", timeout=None, cache=False):
+    """
+    Parse every file under dirname and return a list of (filename, latencies, seconds)
+    sorted by filename. With jobs > 1 the files are spread over a process pool of
+    that size; jobs=0 uses one process per CPU. Results are the same as the serial path.
+    """
+    paths = list_logs(dirname)
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs < 2 or len(paths) < 2:
+        return [file_latency(path, start_str, end_str, log_type, policy, timeout, cache) for path in paths]
+    args = (paths, repeat(start_str), repeat(end_str), repeat(log_type), repeat(policy), repeat(timeout), repeat(cache))
+    chunksize = max(1, len(paths) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        return list(ex.map(file_latency, *args, chunksize=chunksize))
+
+
+def recursive_latency(dirname, start_str, end_str, log_type, jobs=1, policy="nearest", timeout=None, cache=False):
+    res = recursive_latency_timed(dirname, start_str, end_str, log_type, jobs, policy, timeout, cache)
+    return [[t / 1000 for t in times] for _, times, _ in res]
+
+
+def pop_opt(args, opt, default=None):
+    """Remove `opt <value>` from args and return the value, or default when opt is absent."""
+    if opt not in args:
+        return default
+    i = args.index(opt)
+    if i + 1 >= len(args):
+        raise ValueError("option {} requires a value".format(opt))
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+
+
+def pop_flag(args, flag):
+    """Remove flag from args and return whether it was present."""
+    if flag not in args:
+        return False
+    args.remove(flag)
+    return True
 
 
 def main():
-    times = []
     res = None
-    if len(sys.argv) < 2:
+    argv = list(sys.argv)
+    jobs = int(pop_opt(argv, "-j", 1))
+    timing = pop_flag(argv, "--timing")
+    cache = pop_flag(argv, "--cache")
+    policy = pop_opt(argv, "-p")
+    timeout = pop_opt(argv, "-t")
+    if timeout is not None:
+        timeout = float(timeout)
+        if policy not in (None, "timeout"):
+            raise ValueError("-t implies -p timeout, it cannot be combined with -p {}".format(policy))
+        policy = "timeout"
+    policy = policy or "nearest"
+    if len(argv) < 2:
         print(USAGE)
         sys.exit(0)
-    flag = sys.argv[1]
-    if re.match(r"^-l$", flag):
-        fn = sys.argv[2]
-        arg1 = sys.argv[3]
-        arg2 = sys.argv[4]
-        log_type = sys.argv[5]
-        res = log_time_diff_gen(fn, arg1, arg2, log_type=log_type)
-        for r in res:
-            if r > 0:
-                times.append(r)
-            else:
-                print("Results contain negative values, try using '-a' flag instead.")
-        res = (f"Latency List: {times}", f"Average: {sum(times)/len(times)}")
+    flag = argv[1]
+    if re.match(r"^-m$", flag):
+        fn = argv[2]
+        config = argv[3]
+        res = format_metrics(*metric_latencies(fn, load_metrics(config)))
+    elif re.match(r"^--follow$", flag):
+        fn = argv[2]
+        arg1 = argv[3]
+        arg2 = argv[4]
+        log_type = argv[5]
+        matcher = EventMatcher(policy, timeout)
+        stats = RunningStats()
+        try:
+            for latency, stats in follow_latency(fn, arg1, arg2, log_type, matcher, stats):
+                print(f"{latency} ms | {stats}", flush=True)
+        except KeyboardInterrupt:
+            pass
+        res = f"{stats}\nOrphaned ends: {matcher.orphan_ends}  Pending starts: {len(matcher.pending)}"
+    elif re.match(r"^-l$", flag):
+        fn = argv[2]
+        arg1 = argv[3]
+        arg2 = argv[4]
+        log_type = argv[5]
+        matcher = EventMatcher(policy, timeout)
+        first_list, second_list = scan_start_end(fn, arg1, arg2, log_type, cache)
+        times = array("q", time_diffs_ms(first_list, second_list, log_type, matcher))
+        res = "\n".join([f"Latency List (ms): {times.tolist()}", format_report(times),
+                         f"Orphaned starts: {matcher.orphan_starts}  Orphaned ends: {matcher.orphan_ends}"])
     elif re.match(r"^-a$", str(flag)):
-        fn = sys.argv[2]
-        split_str = sys.argv[3]
-        arg1 = sys.argv[4]
-        arg2 = sys.argv[5]
-        if len(sys.argv) < 7:
+        fn = argv[2]
+        split_str = argv[3]
+        arg1 = argv[4]
+        arg2 = argv[5]
+        if len(argv) < 7:
             log_type = "cutecom"
         else:
-            log_type = sys.argv[6]
-        dirname = split_log(fn, split_str)
-        res = recursive_latency(dirname, arg1, arg2, log_type)
-        res = sum(sum(res, [])) / len(sum(res, []))
-        dirname = os.path.join(os.getcwd(), dirname)
-        if os.path.exists(dirname):
-            shutil.rmtree(dirname)
+            log_type = argv[6]
+        res = format_report(array("q", chain.from_iterable(chunk_latencies(fn, split_str, arg1, arg2, log_type, policy, timeout))))
     elif re.match(r"^-r$", flag):
-        dirname = sys.argv[2]
-        arg1 = sys.argv[3]
-        arg2 = sys.argv[4]
-        log_type = sys.argv[5]
-        res = recursive_latency(dirname, arg1, arg2, log_type)
-        res = sum(sum(res, [])) / len(sum(res, []))
+        dirname = argv[2]
+        arg1 = argv[3]
+        arg2 = argv[4]
+        log_type = argv[5]
+        res = recursive_latency_timed(dirname, arg1, arg2, log_type, jobs, policy, timeout, cache)
+        if timing:
+            for filename, lats, secs in res:
+                print(f"{secs:.6f}s {len(lats)} {filename}", file=sys.stderr)
+        res = format_report(array("q", chain.from_iterable(lats for _, lats, _ in res)))
     elif re.match(r"^-s$", flag):
-        fn = sys.argv[2]
-        arg1 = sys.argv[3]
-        dirname = sys.argv[4]
+        fn = argv[2]
+        arg1 = argv[3]
+        dirname = argv[4]
         split_log(fn, arg1, dirname)
         res = f"Logs to parse are in directory {dirname}"
     elif re.match(r"^-f$", flag):
-        fn = sys.argv[2]
-        arg1 = sys.argv[3]
-        log_type = sys.argv[4]
+        fn = argv[2]
+        arg1 = argv[3]
+        log_type = argv[4]
         res = parse_log_datetime_latency(fn, arg1, log_type)
     else:
         print(USAGE)
@@ -0,0 +1,237 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import logparse
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+START_STR = "CMD_START"
+END_STR = "CMD_DONE"
+SPLIT_STR = "=== ITERATION ==="
+LOG_TYPES = ("logcat", "cutecom", "serial")
+MODES = ("-l", "-a", "-r", "-s", "-f")
+DAY_MS = logparse.DAY_MS
+START_MS = (23 * 60 + 30) * 60 * 1000
+PAIRS_PER_ITERATION = 20
+NOISE = [
+    "I/BluetoothGatt: onClientConnectionState() status=0",
+    "D/WifiStateMachine: RSSI poll {}",
+    "heartbeat seq={}",
+    "rx 0x{:04x} bytes",
+    "AT+CSQ",
+    "+CSQ: {},99",
+    "OK",
+]
+
+USAGE = """
+Usage:
+
+    logparse_bench.py -g <filename> <log_type> [size_mb: default=10] [density: default=0.05]
+        -g  generate a synthetic <log_type> log of about <size_mb> MB in which <density> of the lines
+            are start/end events, and write the expected latencies to <filename>.expected.json.
+
+    logparse_bench.py -b <filename> <log_type> [modes: default=-l,-a,-r,-s,-f]
+        -b  time each logparse mode on a generated log in a fresh process and print
+            seconds, lines/s, MB/s, peak RSS and whether the results match the expected latencies.
+
+    logparse_bench.py -A [size_mb: default=10] [density: default=0.05]
+        -A  generate a log for every log_type in a temporary directory and benchmark all modes.
+
+ARGS:
+
+    log_type: one of ['logcat' | 'cutecom' | 'serial']
+    search strings used: start '{}', end '{}', split '{}'.
+""".format(START_STR, END_STR, SPLIT_STR)
+
+
+def fmt_tm(ms, log_type):
+    ms %= DAY_MS
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    if log_type == "serial":
+        return f"{h:02d}:{m:02d}:{s:02d}:{ms:03d}"
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+
+def fmt_line(ms, msg, log_type):
+    tm = fmt_tm(ms, log_type)
+    if log_type == "logcat":
+        return f"01-02 {tm}  1234  5678 D SerialComTools: {msg}\n"
+    if log_type == "serial":
+        return f"[{tm}] {msg}\n"
+    return f"[2024-01-02 {tm} RX] {msg}\n"
+
+
+def noise_line(rng):
+    return rng.choice(NOISE).format(rng.randint(0, 0xffff))
+
+
+def gen_log(filename, log_type="cutecom", size_mb=10, density=0.05, seed=0):
+    """
+    Write a synthetic log of about size_mb megabytes and return its expected results.
+    Start/end pairs never overlap, so every logparse pairing policy finds the same latencies;
+    the log starts at 23:30 so long logs cross midnight. Every end line carries its
+    latency as `latency=<ms>ms` for -f, and a split line is written every
+    PAIRS_PER_ITERATION pairs for -a, -r and -s.
+    """
+    if log_type not in LOG_TYPES:
+        raise ValueError("log_type must be one of {}".format(LOG_TYPES))
+    if not 0 < density <= 1:
+        raise ValueError("density must be in (0, 1]")
+    rng = random.Random(seed)
+    limit = int(size_mb * 1024 * 1024)
+    noise_per_pair = max(0, round(2 / density) - 2)
+    latencies = []
+    lines = size = 0
+    now = START_MS
+    with open(filename, "w", encoding="latin-1", newline="\n") as fh:
+
+        def write(line):
+            nonlocal lines, size
+            fh.write(line)
+            lines += 1
+            size += len(line)
+
+        while size < limit:
+            if len(latencies) % PAIRS_PER_ITERATION == 0:
+                write(f"{SPLIT_STR}\n")
+            inside = rng.randint(0, noise_per_pair)
+            latency = rng.randint(5, 2000)
+            write(fmt_line(now, f"{START_STR} id={len(latencies)}", log_type))
+            for t in sorted(rng.randint(0, latency) for _ in range(inside)):
+                write(fmt_line(now + t, noise_line(rng), log_type))
+            now += latency
+            write(fmt_line(now, f"{END_STR} id={len(latencies)} latency={latency}ms", log_type))
+            latencies.append(latency)
+            for _ in range(noise_per_pair - inside):
+                now += rng.randint(0, 50)
+                write(fmt_line(now, noise_line(rng), log_type))
+            now += rng.randint(1, 50)
+    expected = {"log_type": log_type, "lines": lines, "bytes": size, "latencies": latencies}
+    with open(f"{filename}.expected.json", "w") as fh:
+        json.dump(expected, fh)
+    return expected
+
+
+def run_mode(mode, filename, log_type, workdir):
+    """Run one logparse mode and return (seconds, result summary, peak RSS in bytes or None)."""
+    t0 = time.perf_counter()
+    if mode == "-l":
+        starts, ends = logparse.scan_start_end(filename, START_STR, END_STR, log_type)
+        res = sorted(logparse.time_diffs_ms(starts, ends, log_type))
+    elif mode == "-a":
+        res = sorted(t for lats in logparse.chunk_latencies(filename, SPLIT_STR, START_STR, END_STR, log_type) for t in lats)
+    elif mode == "-r":
+        res = sorted(t for _, lats, _ in logparse.recursive_latency_timed(workdir, START_STR, END_STR, log_type) for t in lats)
+    elif mode == "-s":
+        dirname = os.path.join(workdir, "s")
+        logparse.split_log(filename, SPLIT_STR, dirname)
+        res = len(os.listdir(dirname))
+    elif mode == "-f":
+        res = len(logparse.parse_log_datetime_latency(filename, END_STR, log_type)[END_STR])
+    else:
+        raise ValueError("mode must be one of {}".format(MODES))
+    secs = time.perf_counter() - t0
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak *= 1024
+    return secs, res, peak
+
+
+def check_mode(mode, res, expected):
+    if mode in {"-l", "-a", "-r"}:
+        return res == sorted(expected["latencies"])
+    if mode == "-s":
+        # split_log also writes the empty chunk before the first split line
+        return res == -(-len(expected["latencies"]) // PAIRS_PER_ITERATION) + 1
+    return res == len(expected["latencies"])
+
+
+def bench_log(filename, log_type, modes=MODES):
+    """Benchmark every mode on filename in its own spawned process and return a list of result dicts."""
+    with open(f"{filename}.expected.json", "r") as fh:
+        expected = json.load(fh)
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    workdir = tempfile.mkdtemp(prefix="logparse_bench_")
+    try:
+        logparse.split_log(filename, SPLIT_STR, os.path.join(workdir, "r"))
+        for mode in modes:
+            mode_dir = os.path.join(workdir, "r") if mode == "-r" else tempfile.mkdtemp(dir=workdir)
+            with ctx.Pool(1) as pool:
+                secs, res, peak = pool.apply(run_mode, (mode, filename, log_type, mode_dir))
+            results.append({
+                "mode": mode,
+                "seconds": secs,
+                "lines_per_s": expected["lines"] / secs if secs else float("inf"),
+                "mb_per_s": expected["bytes"] / secs / (1024 * 1024) if secs else float("inf"),
+                "peak_rss": peak,
+                "ok": check_mode(mode, res, expected),
+            })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def format_results(filename, log_type, results):
+    lines = [f"{filename} ({log_type}, {os.path.getsize(filename) / (1024 * 1024):.1f} MB)",
+             f"{'mode':<6}{'seconds':>10}{'lines/s':>14}{'MB/s':>10}{'peak MB':>10}  check"]
+    for r in results:
+        peak = "-" if r["peak_rss"] is None else f"{r['peak_rss'] / (1024 * 1024):.1f}"
+        lines.append(f"{r['mode']:<6}{r['seconds']:>10.3f}{r['lines_per_s']:>14,.0f}{r['mb_per_s']:>10.1f}"
+                     f"{peak:>10}  {'PASS' if r['ok'] else 'FAIL'}")
+    return "\n".join(lines)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(USAGE)
+        sys.exit(0)
+    flag = sys.argv[1]
+    if flag == "-g" and len(sys.argv) > 3:
+        fn = sys.argv[2]
+        log_type = sys.argv[3]
+        size_mb = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+        density = float(sys.argv[5]) if len(sys.argv) > 5 else 0.05
+        expected = gen_log(fn, log_type, size_mb, density)
+        res = f"{fn}: {expected['lines']} lines, {expected['bytes']} bytes, {len(expected['latencies'])} pairs"
+    elif flag == "-b" and len(sys.argv) > 3:
+        fn = sys.argv[2]
+        log_type = sys.argv[3]
+        modes = sys.argv[4].split(",") if len(sys.argv) > 4 else MODES
+        res = format_results(fn, log_type, bench_log(fn, log_type, modes))
+    elif flag == "-A":
+        size_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+        density = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+        tmpdir = tempfile.mkdtemp(prefix="logparse_bench_")
+        out = []
+        try:
+            for log_type in LOG_TYPES:
+                fn = os.path.join(tmpdir, f"{log_type}.log")
+                gen_log(fn, log_type, size_mb, density)
+                out.append(format_results(fn, log_type, bench_log(fn, log_type)))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        res = "\n\n".join(out)
+    else:
+        print(USAGE)
+        sys.exit(0)
+    return res
+
+
+if __name__ == "__main__":
+    result = main()
+    print(result)
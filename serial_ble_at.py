@@ -1,7 +1,11 @@
+import json
 import logging
 import os
+import re
 import serial
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypeVar
 
 FILENAME = "BLE_ESP_AT.log"
@@ -9,44 +13,336 @@ DIRNAME = os.getcwd()
 PATH = os.path.join(DIRNAME, FILENAME)
 PTYPE = TypeVar("PTYPE", str, int)
 RTYPE = TypeVar("RTYPE", list, str)
+FINAL_LINES = frozenset(["OK", "ERROR", "SEND OK", "SEND FAIL"])
+URC_LINES = frozenset(["ready", "busy p...", "busy s...", "WIFI CONNECTED", "WIFI GOT IP", "WIFI DISCONNECT"])
+URC_MAX = 1024
+CMD_REGX = re.compile(r"AT\+([A-Z0-9_]+)")
+SET_REGX = re.compile(r"AT\+([A-Z0-9_]+)=(.*)$")
+RESP_REGX = re.compile(r"\+([A-Z0-9_]+):")
+OK_LINES = frozenset(["OK", "SEND OK"])
+PROFILE_KEYS = ("wifi", "init", "adv_param", "adv_data", "scan_param", "advertise", "commands")
+SCAN_PREFIX = "+BLESCAN:"
+RESET_URCS = frozenset(["ready"])
+RESET_CMDS = frozenset(["AT+RST", "AT+RESTORE"])
+CACHE_KEYS = {
+    "CWMODE": ("mode",),
+    "BLEINIT": ("role",),
+    "BLEADDR": ("addr",),
+    "BLEADVPARAM": ("adv_int_min", "adv_int_max", "adv_type", "own_addr_type", "channel_map",
+                    "filter_policy", "peer_addr_type", "peer_addr"),
+    "BLEADVDATAEX": ("dev_name", "uuid", "data", "tx_pwr"),
+    "BLESCANPARAM": ("scan_type", "own_addr_type", "filter_policy", "scan_interval", "scan_window"),
+}
+SCAN_POLL_INTERVAL = 0.2
+BUSY_LINE = "busy p..."
+BUSY_RETRIES = 3
+BUSY_BACKOFF = 0.05
 
 logging.basicConfig(filename=PATH, level=logging.DEBUG, filemode="a",
                 format="%(asctime)s - %(module)s - %(levelname)s - %(funcName)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+def cmd_name(cmd: str):
+    """Return BLEADDR for AT+BLEADDR?, or None for commands without a name."""
+    m = CMD_REGX.match(cmd)
+    return m.group(1) if m else None
+
+
+def adv_param_cmd(int_min: int, int_max: int, adv_type: int, addr_type: int, adv_chnl: int,
+                  adv_filter_policy: int=None, peer_addr_type: int=None, peer_addr: str=None) -> str:
+    """AT+BLEADVPARAM command, see Peripheral_BLE.set_ble_adv_param."""
+    if adv_filter_policy is not None and peer_addr_type is not None and peer_addr is not None:
+        return "AT+BLEADVPARAM={},{},{},{},{},{},{},\"{}\"".format(int_min, int_max, adv_type, addr_type,
+                                                                 adv_chnl, adv_filter_policy, peer_addr_type, peer_addr)
+    return "AT+BLEADVPARAM={},{},{},{},{}".format(int_min, int_max, adv_type, addr_type, adv_chnl)
+
+
+def adv_data_cmd(dev_name: str, uuid: str, data: str, tx_pwr: int) -> str:
+    """AT+BLEADVDATAEX command, see Peripheral_BLE.set_ble_adv_data."""
+    return "AT+BLEADVDATAEX=\"{}\",\"{}\",\"{}\",{}".format(dev_name, uuid, data, tx_pwr)
+
+
+def scan_param_cmd(scan_type: int, addr_type: int, filter_policy: int, scan_interval: int, scan_window: int) -> str:
+    """AT+BLESCANPARAM command, see Central_BLE.set_ble_scan_param."""
+    return f"AT+BLESCANPARAM={scan_type},{addr_type},{filter_policy},{scan_interval},{scan_window}"
+
+
+PROFILE_CMDS = {
+    "adv_param": ("BLEADVPARAM", adv_param_cmd),
+    "adv_data": ("BLEADVDATAEX", adv_data_cmd),
+    "scan_param": ("BLESCANPARAM", scan_param_cmd),
+}
+
+
+def parse_values(args: str) -> list:
+    """Split AT arguments or query results on commas and drop the quotes around strings."""
+    return [v.strip('"') for v in args.split(",")]
+
+
+def compile_profile(profile: dict, role: int=None) -> list:
+    """
+    Compile a device profile into the list of AT commands that apply it.
+    Keys, all optional, compiled in this order:
+        "wifi": false           AT+CWMODE=0
+        "init": true            AT+BLEINIT=<role> (1: central, 2: peripheral)
+        "adv_param": {...}      AT+BLEADVPARAM, keys as the set_ble_adv_param arguments
+        "adv_data": {...}       AT+BLEADVDATAEX, keys as the set_ble_adv_data arguments
+        "scan_param": {...}     AT+BLESCANPARAM, keys as the set_ble_scan_param arguments
+        "advertise": true       AT+BLEADVSTART
+        "commands": [...]       sent as is
+    """
+    unknown = set(profile) - set(PROFILE_KEYS)
+    if unknown:
+        raise ValueError("unknown profile keys {}, must be among {}".format(sorted(unknown), PROFILE_KEYS))
+    cmds = []
+    if profile.get("wifi") is False:
+        cmds.append("AT+CWMODE=0")
+    if profile.get("init"):
+        if role is None:
+            raise ValueError("init needs a role: 1 for central or 2 for peripheral")
+        cmds.append("AT+BLEINIT={}".format(role))
+    for key, (_, build) in PROFILE_CMDS.items():
+        if key in profile:
+            try:
+                cmds.append(build(**profile[key]))
+            except TypeError as err:
+                raise ValueError("{}: {}".format(key, err))
+    if profile.get("advertise"):
+        cmds.append("AT+BLEADVSTART")
+    cmds.extend(profile.get("commands", []))
+    return cmds
+
+
+def load_profile(filename) -> dict:
+    with open(filename, "r") as fh:
+        profile = json.load(fh)
+    if not isinstance(profile, dict):
+        raise ValueError("{}: profile must be a JSON object".format(filename))
+    return profile
+
+
+def parse_scan_line(line: str) -> dict:
+    """
+    Parse +BLESCAN:<addr>,<rssi>,<adv_data>,<scan_rsp_data>,<addr_type> into a record with
+    the time it was parsed, or return None for any other or malformed line.
+    """
+    if not line.startswith(SCAN_PREFIX):
+        return None
+    vals = line[len(SCAN_PREFIX):].split(",")
+    if len(vals) < 5:
+        return None
+    try:
+        rssi = int(vals[1])
+    except ValueError:
+        return None
+    return {"addr": vals[0], "rssi": rssi, "adv_data": vals[2], "rsp_data": vals[3],
+            "addr_type": vals[4], "ts": time.time()}
+
+
+class ScanStats:
+    """Running aggregate of the adverts seen from one address: count, RSSI min/max/mean, first/last seen."""
+    __slots__ = ("addr", "count", "rssi_min", "rssi_max", "rssi_mean", "first_seen", "last_seen",
+                 "adv_data", "rsp_data", "addr_type")
+
+    def __init__(self, addr: str):
+        self.addr = addr
+        self.count = 0
+        self.rssi_min = None
+        self.rssi_max = None
+        self.rssi_mean = 0.0
+        self.first_seen = None
+        self.last_seen = None
+        self.adv_data = ""
+        self.rsp_data = ""
+        self.addr_type = ""
+
+    def add(self, rec: dict) -> None:
+        self.count += 1
+        rssi = rec["rssi"]
+        self.rssi_mean += (rssi - self.rssi_mean) / self.count
+        self.rssi_min = rssi if self.rssi_min is None else min(self.rssi_min, rssi)
+        self.rssi_max = rssi if self.rssi_max is None else max(self.rssi_max, rssi)
+        if self.first_seen is None:
+            self.first_seen = rec["ts"]
+        self.last_seen = rec["ts"]
+        # scan responses come in separate adverts with empty adv data, keep the last non-empty of each
+        self.adv_data = rec["adv_data"] or self.adv_data
+        self.rsp_data = rec["rsp_data"] or self.rsp_data
+        self.addr_type = rec["addr_type"]
+
+    def as_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
 class SerialPort:
+    """
+    AT command port. read_response() returns as soon as the final result line of the last
+    command (OK, ERROR, SEND OK or SEND FAIL) arrives, or after timeout seconds.
+    Unsolicited result codes seen meanwhile (lines in URC_LINES and +<NAME>: lines for
+    another command) are kept in urcs instead of the response.
+    """
+
     def __init__(self, device, baud, timeout=1, rtscts=False):
         self.port = serial.Serial(device, baudrate=baud, timeout=timeout, rtscts=rtscts)
+        self.timeout = timeout
+        self.urcs = deque(maxlen=URC_MAX)
+        self.on_urc = None
+        self.last_cmd = None
+        self._buf = b""
+        self._lines = deque()
+        self._cmd_name = None
 
     def write_cmd(self, cmd):
+        self.last_cmd = cmd
+        self._cmd_name = cmd_name(cmd)
         self.port.write("{}\r\n".format(cmd).encode())
-        time.sleep(0.5)
         self.port.flush()
-        time.sleep(0.5)
 
     def write_no_crlf(self, cmd):
         self.port.write(str(cmd).encode())
-        time.sleep(0.5)
         self.port.flush()
-        time.sleep(0.5)
 
-    def read_response(self, size=None):
+    def is_urc(self, line: str) -> bool:
+        if line in URC_LINES:
+            return True
+        m = RESP_REGX.match(line)
+        return m is not None and m.group(1) != self._cmd_name
+
+    def add_urc(self, line: str) -> None:
+        self.urcs.append(line)
+        logger.debug("URC: {}".format(line))
+        if self.on_urc is not None:
+            self.on_urc(line)
+
+    def read_line(self, timeout):
+        """Return the next non-empty line without its line ending, or None after timeout seconds."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            while self._lines:
+                line = self._lines.popleft().decode(errors="replace").strip("\r")
+                if line:
+                    return line
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                return None
+            self.port.timeout = left
+            try:
+                data = self.port.read(1)
+            finally:
+                self.port.timeout = self.timeout
+            if data and self.port.in_waiting:
+                data += self.port.read(self.port.in_waiting)
+            if b"\n" in data:
+                # split every complete line at once, a flood of scan lines must not rescan the buffer per line
+                *lines, self._buf = (self._buf + data).split(b"\n")
+                self._lines.extend(lines)
+            else:
+                self._buf += data
+
+    def read_lines(self, timeout=None, busy_final=False):
+        """
+        Read the response to the last command up to and including its final result line.
+        Returns (response lines, True if a final line arrived before timeout seconds).
+        With busy_final a busy p... also ends the response instead of being kept as a URC.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.perf_counter() + timeout
+        res = []
+        while True:
+            line = self.read_line(max(0, deadline - time.perf_counter()))
+            if line is None:
+                return res, False
+            if busy_final and line == BUSY_LINE:
+                res.append(line)
+                return res, True
+            if self.is_urc(line):
+                self.add_urc(line)
+                continue
+            res.append(line)
+            if line in FINAL_LINES:
+                return res, True
+
+    def run_batch(self, cmds: list, depth: int=None, timeout: float=None, retries: int=BUSY_RETRIES) -> list:
+        """
+        Send cmds pipelined, up to depth (default 1) ahead of the replies, in as few writes
+        as possible, and match the final result lines back to the commands in order.
+        Each reply must arrive within timeout seconds of the previous one. After a timeout
+        the replies can no longer be matched, so the remaining commands are reported as
+        NOT MATCHED. Returns [{"cmd", "resp", "status", "ms"}] where status is the final
+        line, busy p..., TIMEOUT or NOT MATCHED and ms the time from send to final line.
+        The firmware answers busy p... to a command arriving while another one runs. At
+        depth 1 that command is resent after BUSY_BACKOFF seconds, up to retries times;
+        deeper, the busy line cannot be told apart from the others in flight, so the
+        command being matched is failed with it, the rest are NOT MATCHED and the replies
+        still in flight are discarded.
+        """
+        depth = 1 if depth is None else depth
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        results = []
+        sent_at = []
+        for i, cmd in enumerate(cmds):
+            if len(sent_at) < min(len(cmds), i + depth):
+                batch = cmds[len(sent_at):i + depth]
+                self.port.write("".join("{}\r\n".format(c) for c in batch).encode())
+                self.port.flush()
+                sent_at.extend([time.perf_counter()] * len(batch))
+            self._cmd_name = cmd_name(cmd)
+            resp, done = self.read_lines(timeout, busy_final=True)
+            tries = 0
+            while done and resp[-1] == BUSY_LINE and depth == 1 and tries < retries:
+                tries += 1
+                logger.debug("{} rejected busy, resending ({}/{})".format(cmd, tries, retries))
+                time.sleep(BUSY_BACKOFF)
+                self.write_cmd(cmd)
+                resp, done = self.read_lines(timeout, busy_final=True)
+            results.append({
+                "cmd": cmd,
+                "resp": resp,
+                "status": resp[-1] if done else "TIMEOUT",
+                "ms": (time.perf_counter() - sent_at[i]) * 1000,
+            })
+            busy = done and resp[-1] == BUSY_LINE and depth > 1
+            if not done or busy:
+                results.extend({"cmd": c, "resp": [], "status": "NOT MATCHED", "ms": None} for c in cmds[i + 1:])
+                if busy:
+                    logger.warning("Batch stopped: firmware answered busy p... at depth {}, use depth=1".format(depth))
+                    self.discard_lines(timeout)
+                break
+        return results
+
+    def discard_lines(self, timeout=None):
+        """Read and drop lines until none arrives for timeout seconds, keeping URCs."""
+        timeout = self.timeout if timeout is None else timeout
+        self._cmd_name = None
+        while True:
+            line = self.read_line(timeout)
+            if line is None:
+                return
+            if self.is_urc(line):
+                self.add_urc(line)
+
+    def read_response(self, size=None, timeout=None):
         res = None
         if not self.port.is_open:
             self.port.open()
         if size is None:
-            msg = self.port.readlines()
-            res = [str(m.decode()) for m in msg]
-            res = [m.strip("\r\n") for m in res if m.find("\r\n")]
+            res, done = self.read_lines(timeout)
+            if not done:
+                logger.warning("No final result line within timeout, got: {}".format(res))
         elif type(size) == int:
-            msg = self.port.read(size)
+            pending = b"".join(line + b"\n" for line in self._lines) + self._buf
+            self._lines.clear()
+            msg, self._buf = pending[:size], pending[size:]
+            if len(msg) < size:
+                msg += self.port.read(size - len(msg))
             res = msg.decode()
         else:
             raise ValueError("size must be an integer or None")
         return res
 
     def close_port(self):
-        if self.port.is_open():
+        if self.port.is_open:
             self.port.close()
             logger.info("Serial port has been closed.")
         else:
@@ -54,17 +350,77 @@ class SerialPort:
 
 
 class BLE_AT:
+    """
+    attributes caches what is known of the device state, keyed by command name (BLEADVPARAM, ...).
+    Every set the device answers OK to is written through, the get_* queries are served from it
+    unless refresh=True, and it is cleared on AT+BLEINIT (BLE entries), AT+RST and the ready URC
+    a module prints after resetting.
+    """
+    role = None
 
     def __init__(self, port, baud=115200, timeout=1, rtscts=False, verbose=False):
         self.ser = SerialPort(port, baud=baud, timeout=timeout, rtscts=rtscts)
+        self.ser.on_urc = self._on_urc
         self.verbose = verbose
         self.attributes = {}
+        self.scan_results = {}
 
     def _disable_wifi_mode(self) -> None:
         self.ser.write_cmd("AT+CWMODE=0")
         resp = self.ser.read_response()
+        self._update_cache("AT+CWMODE=0", resp)
         logger.info("Disabled WIFI mode: {}".format(resp))
 
+    def invalidate(self, name: str=None) -> None:
+        """Forget the cached attribute name, or every attribute."""
+        if name is None:
+            self.attributes.clear()
+        else:
+            self.attributes.pop(name, None)
+
+    def _on_urc(self, line: str) -> None:
+        if line in RESET_URCS:
+            self.invalidate()
+            logger.warning("Module reset, attribute cache cleared.")
+
+    def _update_cache(self, cmd: str, resp: list) -> None:
+        """Write the parameters of cmd through to attributes if the device answered OK."""
+        if not resp or resp[-1] not in OK_LINES:
+            return
+        if cmd in RESET_CMDS:
+            self.invalidate()
+            return
+        m = SET_REGX.match(cmd)
+        if m is None:
+            return
+        name, values = m.group(1), parse_values(m.group(2))
+        if name == "BLEINIT":
+            for key in [k for k in self.attributes if k.startswith("BLE")]:
+                del self.attributes[key]
+        keys = CACHE_KEYS.get(name)
+        if keys is None:
+            self.attributes[name] = values[0] if len(values) == 1 else values
+        elif len(values) == len(keys):
+            self.attributes[name] = dict(zip(keys, values))
+        elif name in self.attributes:
+            # optional arguments left out keep their previous values
+            self.attributes[name].update(zip(keys, values))
+
+    def _query(self, name: str, refresh: bool=False) -> dict:
+        """Return AT+<name>? as a dict of CACHE_KEYS[name], from attributes unless refresh, or None if it failed."""
+        if not refresh and name in self.attributes:
+            return dict(self.attributes[name])
+        self.ser.write_cmd("AT+{}?".format(name))
+        resp = self.ser.read_response()
+        self._verbose(resp)
+        prefix = "+{}:".format(name)
+        for line in resp:
+            if line.startswith(prefix):
+                self.attributes[name] = dict(zip(CACHE_KEYS[name], parse_values(line[len(prefix):])))
+                return dict(self.attributes[name])
+        logger.error("{} query failed: {}".format(name, resp))
+        return None
+
     def _verbose(self, msg: str) -> None:
         if self.verbose == True:
             print(msg)
@@ -75,17 +431,16 @@ class BLE_AT:
     def ble_deinit(self) -> None:
         self.ser.write_cmd("AT+BLEINIT=0")
         resp = self.ser.read_response()
+        self._update_cache("AT+BLEINIT=0", resp)
         self._verbose(resp)
         logger.info("BLE deinitialized: {}".format(resp))
 
-    def get_ble_addr(self) -> str:
-        """Get BLE address."""
-        self.ser.write_cmd("AT+BLEADDR?")
-        resp = self.ser.read_response()
-        self._verbose(resp)
-        resp = resp[1].strip("+BLEADDR:")
-        logger.info("BLE address: {}".format(resp))
-        return str(resp)
+    def get_ble_addr(self, refresh: bool=False) -> str:
+        """Get BLE address, from the cache unless refresh."""
+        resp = self._query("BLEADDR", refresh)
+        addr = None if resp is None else resp["addr"]
+        logger.info("BLE address: {}".format(addr))
+        return addr
 
     def set_param(self, cmd: str, param: PTYPE) -> RTYPE:
         if type(param) == int:
@@ -95,17 +450,81 @@ class BLE_AT:
         else:
             raise ValueError("Parameter must be an integer or string.")
         resp = self.ser.read_response()
-        self.attributes[cmd] = param
+        self._update_cache(self.ser.last_cmd, resp)
         self._verbose(resp)
         logger.info("Parameter has been set: {}={}".format(cmd, resp)) 
         return resp
 
-    def get_resp(self, cmd) -> RTYPE:
+    def get_resp(self, cmd, timeout: float=None) -> RTYPE:
+        """Send cmd and return its response lines, waiting up to timeout seconds (default: the port timeout)."""
         self.ser.write_cmd(cmd)
-        resp = self.ser.read_response()
+        resp = self.ser.read_response(timeout=timeout)
+        self._update_cache(cmd, resp)
         self._verbose(resp)
         return resp
 
+    def get_urcs(self) -> list:
+        """Return and clear the unsolicited result codes received so far."""
+        urcs = list(self.ser.urcs)
+        self.ser.urcs.clear()
+        return urcs
+
+    def apply_profile(self, profile, depth: int=None, timeout: float=None) -> list:
+        """
+        Apply a device profile (a dict, or the path of a JSON file) as one batch, pipelined
+        depth commands deep, see compile_profile for the keys and SerialPort.run_batch for
+        the results and busy handling.
+        Returns the results; failed steps are logged.
+        """
+        if not isinstance(profile, dict):
+            profile = load_profile(profile)
+        results = self.ser.run_batch(compile_profile(profile, self.role), depth, timeout)
+        for r in results:
+            self._update_cache(r["cmd"], r["resp"])
+            self._verbose("{cmd}: {status}".format(**r))
+            if r["status"] not in OK_LINES:
+                logger.error("Profile step failed: {cmd}: {status} {resp}".format(**r))
+        logger.info("Profile applied: {} commands, {} failed".format(
+            len(results), sum(r["status"] not in OK_LINES for r in results)))
+        return results
+
+    def diff_profile(self, profile: dict, refresh: bool=False) -> dict:
+        """
+        Return the part of profile that would change the device. Parameter sets are dropped when
+        the known values (queried if not cached, or always with refresh) already match, init and
+        wifi when the device is already in that state; advertise and commands are always kept.
+        Re-initialising resets the parameters, so with init in the diff every parameter set is too.
+        """
+        compile_profile(profile, self.role)
+        init = False
+        if profile.get("init"):
+            current = self._query("BLEINIT", refresh)
+            init = current is None or current["role"] != str(self.role)
+        diff = {}
+        for key, value in profile.items():
+            if key == "init" and not init:
+                continue
+            if key == "wifi" and value is False:
+                current = self._query("CWMODE", refresh)
+                if current is not None and current["mode"] == "0":
+                    continue
+            if key in PROFILE_CMDS and not init:
+                name, build = PROFILE_CMDS[key]
+                want = parse_values(build(**value).partition("=")[2])
+                current = self._query(name, refresh)
+                if current is not None and [current.get(k) for k in CACHE_KEYS[name][:len(want)]] == want:
+                    continue
+            diff[key] = value
+        return diff
+
+    def apply_diff(self, profile, refresh: bool=False, depth: int=None, timeout: float=None) -> list:
+        """apply_profile with only the part of profile that differs from the device, see diff_profile."""
+        if not isinstance(profile, dict):
+            profile = load_profile(profile)
+        diff = self.diff_profile(profile, refresh)
+        logger.info("Profile diff: {} of {} keys to apply: {}".format(len(diff), len(profile), sorted(diff)))
+        return self.apply_profile(diff, depth, timeout)
+
     def get_help(self) -> RTYPE :
         self.ser.write_cmd("AT+CMD?")
         help_resp = self.ser.read_response()
@@ -114,10 +533,12 @@ class BLE_AT:
 
 
 class Peripheral_BLE(BLE_AT):
+    role = 2
 
     def ble_init(self):
         self.ser.write_cmd("AT+BLEINIT=2")
         resp = self.ser.read_response()
+        self._update_cache("AT+BLEINIT=2", resp)
         self._verbose(resp)
         logger.info("BLE peripheral device initialized.")
 
@@ -132,9 +553,10 @@ class Peripheral_BLE(BLE_AT):
             0: do not include TX power in advertising data
             1: include TX power in advertising data
         """
-        self.ser.write_cmd("AT+BLEADVDATAEX=\"{}\",\"{}\",\"{}\",{}".format(dev_name, uuid,
-                                                                            data, tx_pwr))
+        cmd = adv_data_cmd(dev_name, uuid, data, tx_pwr)
+        self.ser.write_cmd(cmd)
         resp = self.ser.read_response()
+        self._update_cache(cmd, resp)
         self._verbose(resp)
         adv_dict = {
             "dev_name": dev_name,
@@ -144,18 +566,9 @@ class Peripheral_BLE(BLE_AT):
         }
         logger.debug("ADV data set: {}".format(adv_dict))
 
-    def get_ble_adv_data(self) -> dict:
-        """Get BLE advertising data."""
-        self.ser.write_cmd("AT+BLEADVDATAEX?")
-        resp = self.ser.read_response()
-        self._verbose(resp)
-        resp = resp[1].strip("+BLEADVDATAEX:").split(",")
-        adv_dict = {
-            "dev_name": resp[0],
-            "uuid": resp[1],
-            "data": resp[2],
-            "tx_pwr": resp[3]
-        }
+    def get_ble_adv_data(self, refresh: bool=False) -> dict:
+        """Get BLE advertising data, from the cache unless refresh."""
+        adv_dict = self._query("BLEADVDATAEX", refresh)
         logger.debug("ADV data query: {}".format(adv_dict))
         return adv_dict
 
@@ -190,35 +603,21 @@ class Peripheral_BLE(BLE_AT):
             1: RANDOM
         [<peer_addr>]: remote peer bd_addr
         """
-        if adv_filter_policy is not None and peer_addr_type is not None and peer_addr is not None:
-            self.ser.write_cmd("AT+BLEADVPARAM={},{},{},{},{},{},{},\"{}\"".format(int_min, int_max, adv_type, addr_type, 
-                                                                        adv_chnl, adv_filter_policy, peer_addr_type, peer_addr))
-        else:
-            self.ser.write_cmd("AT+BLEADVPARAM={},{},{},{},{}".format(int_min, int_max, adv_type, addr_type, adv_chnl))
+        cmd = adv_param_cmd(int_min, int_max, adv_type, addr_type, adv_chnl,
+                            adv_filter_policy, peer_addr_type, peer_addr)
+        self.ser.write_cmd(cmd)
         resp = self.ser.read_response()
+        self._update_cache(cmd, resp)
         self._verbose(resp)
         logger.debug("Advertising parameters set: {}".format(resp))
 
-    def get_ble_adv_param(self) -> dict:
+    def get_ble_adv_param(self, refresh: bool=False) -> dict:
         """
-        Get advertising parameters.
+        Get advertising parameters, from the cache unless refresh.
         Response: <adv_int_min>,<adv_int_max>,<adv_type>,<own_addr_type>,<channel_map>,
                   <filter_policy>,<peer_addr_type>,<peer_addr>
         """
-        self.ser.write_cmd("AT+BLEADVPARAM?")
-        resp = self.ser.read_response()
-        self._verbose(resp)
-        resp = resp[1].strip("+BLEADVPARAM:").split(",")
-        param_dict = {
-            "adv_int_min": resp[0],
-            "adv_int_max": resp[1],
-            "adv_type": resp[2],
-            "own_addr_type": resp[3],
-            "channel_map": resp[4],
-            "filter_policy": resp[5],
-            "peer_addr_type": resp[6],
-            "peer_addr": resp[7]
-        }
+        param_dict = self._query("BLEADVPARAM", refresh)
         logger.info("Advertising parameters queried: {}".format(param_dict))
         return param_dict
 
@@ -238,10 +637,12 @@ class Peripheral_BLE(BLE_AT):
 
 
 class Central_BLE(BLE_AT):
+    role = 1
 
     def ble_init(self):
         self.ser.write_cmd("AT+BLEINIT=1")
         resp = self.ser.read_response()
+        self._update_cache("AT+BLEINIT=1", resp)
         self._verbose(resp)
         logger.info("BLE central device initialized.")
 
@@ -265,33 +666,22 @@ class Central_BLE(BLE_AT):
         <scan_interval>: range 0x0004-0x4000
         <scan_window>: range 0x0004-0x4000 and < <scan_interval>
         """
-        self.ser.write_cmd(f"AT+BLESCANPARAM={scan_type},{addr_type},{filter_policy},{scan_interval},{scan_window}")
+        cmd = scan_param_cmd(scan_type, addr_type, filter_policy, scan_interval, scan_window)
+        self.ser.write_cmd(cmd)
         resp = self.ser.read_response()
+        self._update_cache(cmd, resp)
         self._verbose(resp)
         logger.debug("BLE Scan Parameters: scan_type={}, addr_type={}, filter_policy={}"\
                      "scan_interval={}, scan_window={}".format(scan_type, addr_type, filter_policy,
                                                                 scan_interval, scan_window))
-        self.attributes["BLESCANPARAM"] = [scan_type, addr_type, filter_policy, scan_interval, scan_window]
 
-    def get_ble_scan_params(self) -> dict:
+    def get_ble_scan_params(self, refresh: bool=False) -> dict:
         """
-        Get BLE scan parameters currently set.
+        Get BLE scan parameters currently set, from the cache unless refresh.
         Response: <scan_type>,<own_type_addr>,<filter_policy>,<scan_interval>,<scan_window>
         """
-        self.ser.write_cmd("AT+BLESCANPARAM?")
-        resp = self.ser.read_response()
-        self._verbose(resp)
-        params = resp[1].strip("+BLESCANPARAM:").split(",")
-        self.attributes["BLESCANPARAM"] = params
-        logger.debug("BLE scan parameters: scan_type={}, addr_type={}, filter_policy={}, "\
-                     "scan_interval={}, scan_window={}".format(*params))
-        param_dict = {
-            "scan_type": params[0],
-            "own_addr_type": params[1],
-            "filter_policy": params[2],
-            "scan_interval": params[3],
-            "scan_window": params[4]
-        }
+        param_dict = self._query("BLESCANPARAM", refresh)
+        logger.debug("BLE scan parameters: {}".format(param_dict))
         return param_dict
 
     def filter_ble_scan(self, interval: int, filter_type: int, filter_param: str=None) -> None:
@@ -321,8 +711,59 @@ class Central_BLE(BLE_AT):
         self._verbose(resp)
 
 
+    def _add_scan_record(self, rec: dict) -> None:
+        stats = self.scan_results.get(rec["addr"])
+        if stats is None:
+            stats = self.scan_results[rec["addr"]] = ScanStats(rec["addr"])
+        stats.add(rec)
+
+    def scan_iter(self, duration: float=None, timeout: float=None):
+        """
+        Start a BLE scan and yield each parsed +BLESCAN record as it arrives, while keeping
+        per-address aggregates in scan_results (reset by start_ble_scan).
+        The scan stops after duration seconds, or when the generator is closed; adverts that
+        arrive while stopping still go into scan_results but are not yielded.
+        """
+        self.start_ble_scan()
+        deadline = None if duration is None else time.perf_counter() + duration
+        try:
+            while True:
+                wait = SCAN_POLL_INTERVAL
+                if deadline is not None:
+                    wait = deadline - time.perf_counter()
+                    if wait <= 0:
+                        return
+                line = self.ser.read_line(wait)
+                if line is None:
+                    continue
+                rec = parse_scan_line(line)
+                if rec is None:
+                    self.ser.add_urc(line)
+                    continue
+                self._add_scan_record(rec)
+                yield rec
+        finally:
+            self._stop_scan(timeout)
+
+    def scan_for(self, duration: float, callback=None) -> dict:
+        """Scan for duration seconds calling callback(record) per advert, and return scan_results."""
+        for rec in self.scan_iter(duration):
+            if callback is not None:
+                callback(rec)
+        return self.scan_results
+
+    def _stop_scan(self, timeout: float=None) -> list:
+        self.ser.write_cmd("AT+BLESCAN=0")
+        resp = self.ser.read_response(timeout=timeout)
+        recs = [rec for rec in map(parse_scan_line, resp) if rec is not None]
+        for rec in recs:
+            self._add_scan_record(rec)
+        logger.info("Stopping BLE scan: {} addresses seen.".format(len(self.scan_results)))
+        return recs
+
     def start_ble_scan(self):
         """Starts continuous BLE scan."""
+        self.scan_results = {}
         self.ser.write_cmd("AT+BLESCAN=1")
         resp = self.ser.read_response()
         self._verbose(resp)
@@ -337,32 +778,120 @@ class Central_BLE(BLE_AT):
         } 
         try:
             return addr_types[str(val)]
-        except IndexError as err:
+        except KeyError:
             logger.error("Unknown address type: {}".format(val))
         return "Unknown"
 
     def stop_ble_scan(self) -> dict:
         """
-        Stops BLE scan.
+        Stops BLE scan and returns the latest advert of every address buffered since start_ble_scan.
         Response: <addr>,<rssi>,<adv_data>,<scan_rsp_data>,<addr_type>
+        For long or dense scans use scan_iter, which drains adverts as they arrive.
         """
         discovered = {}
-        self.ser.write_cmd("AT+BLESCAN=0")
-        resp = self.ser.read_response()
-        self._verbose(resp)
-        logger.info("Stopping BLE scan.")
-        for res in resp[:-2]:
-            vals = res.strip("+BLESCAN:").split(",")
-            discovered[vals[0]] = {
-                "Address": vals[0],
-                "RSSI": vals[1],
-                "ADV Data": vals[2],
-                "Response Data": vals[3],
-                "Address Type": self._get_addr_type(vals[4])
+        for rec in self._stop_scan():
+            discovered[rec["addr"]] = {
+                "Address": rec["addr"],
+                "RSSI": str(rec["rssi"]),
+                "ADV Data": rec["adv_data"],
+                "Response Data": rec["rsp_data"],
+                "Address Type": self._get_addr_type(rec["addr_type"])
             }
+        self._verbose(discovered)
         logger.info("BLE Scan Results: {}".format(discovered))
         return discovered
 
+
+class BLEFleet:
+    """
+    Many modules driven at once: run() calls the same BLE_AT method on every device, each from
+    its own worker thread, so a fleet operation takes about as long as its slowest device.
+    Results are {port: {"result": ..., "error": None or the exception, "ms": ...}}; a device
+    that failed to open keeps its error in every later result instead of being called.
+    """
+
+    def __init__(self, ports: list, cls=Central_BLE, baud=115200, timeout=1, rtscts=False,
+                 verbose=False, workers: int=None):
+        self.ports = list(ports)
+        if not self.ports:
+            raise ValueError("ports must not be empty")
+        self.devices = {}
+        self.open_errors = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers or len(self.ports))
+        opened = self._map(lambda port: cls(port, baud, timeout, rtscts, verbose), self.ports)
+        for port, r in opened.items():
+            if r["error"] is None:
+                self.devices[port] = r["result"]
+            else:
+                self.open_errors[port] = r["error"]
+                logger.error("Fleet: {} failed to open: {}".format(port, r["error"]))
+
+    @staticmethod
+    def _call(fn, arg):
+        start = time.perf_counter()
+        try:
+            result, error = fn(arg), None
+        except Exception as e:
+            result, error = None, e
+        return {"result": result, "error": error, "ms": (time.perf_counter() - start) * 1000}
+
+    def _map(self, fn, items) -> dict:
+        futures = {item: self._pool.submit(self._call, fn, item) for item in items}
+        return {item: f.result() for item, f in futures.items()}
+
+    def run(self, op, *args, **kwargs) -> dict:
+        """
+        Call op on every open device concurrently: op is a method name ("ble_init") or a
+        function called as op(device, *args, **kwargs). Returns the results by port.
+        """
+        if isinstance(op, str):
+            fn = lambda dev: getattr(dev, op)(*args, **kwargs)
+        else:
+            fn = lambda dev: op(dev, *args, **kwargs)
+        done = self._map(lambda port: fn(self.devices[port]), self.devices)
+        results = {}
+        for port in self.ports:
+            if port in done:
+                results[port] = done[port]
+            else:
+                results[port] = {"result": None, "error": self.open_errors[port], "ms": 0.0}
+        failed = [port for port, r in results.items() if r["error"] is not None]
+        logger.info("Fleet {}: {} devices, {} failed {}".format(
+            getattr(op, "__name__", op), len(results), len(failed), failed))
+        return results
+
+    def init(self) -> dict:
+        return self.run("ble_init")
+
+    def configure(self, profile, depth: int=None, timeout: float=None) -> dict:
+        """Apply profile to every device (see BLE_AT.apply_profile); load a profile file only once."""
+        if not isinstance(profile, dict):
+            profile = load_profile(profile)
+        return self.run("apply_profile", profile, depth, timeout)
+
+    def advertise(self) -> dict:
+        return self.run("start_ble_adv")
+
+    def scan(self, duration: float) -> dict:
+        """Scan on every device for duration seconds; each result is that device's scan_results."""
+        return self.run("scan_for", duration)
+
+    def close(self) -> None:
+        self.run(lambda dev: dev.ser.close_port())
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def failed(results: dict) -> dict:
+    """{port: error} for the devices of a BLEFleet result that raised."""
+    return {port: r["error"] for port, r in results.items() if r["error"] is not None}
+
+
 def mul_625(n):
     int_mul = {}
     for i in range(n):
@@ -0,0 +1,398 @@
+import bisect
+import datetime
+import io
+import os
+import select
+import struct
+import sys
+import time
+
+from logparse import RunningStats
+
+
+USAGE = """
+Usage:
+
+    serial_capture.py -i <capture>
+        -i  print the start time, duration, record and byte counts of <capture>.
+
+    serial_capture.py -d <capture>
+        -d  print <capture> as text, one `[<date> <time> RX] <line>` per received line,
+            the same format logparse reads as cutecom.
+
+    serial_capture.py -p <capture> [speed: default=1]
+        -p  open a pseudo-terminal, print its path and replay <capture> into it once Enter is pressed.
+            speed scales the original timing (2: twice as fast), 0 writes as fast as possible.
+
+    serial_capture.py -x <capture>
+        -x  rebuild the seek index <capture>.idx.
+
+    captures are written by `serial_com.py <tty> --capture <capture>`.
+"""
+
+MAGIC = b"SERCAP"
+VERSION = 1
+HEADER = struct.Struct("<6sHq")
+RECORD = struct.Struct("<QI")
+INDEX_ENTRY = struct.Struct("<QQ")
+INDEX_INTERVAL = 256
+FLUSH_INTERVAL = 1.0
+FLUSH_RECORDS = 1024
+REPLAY_CHUNK = 4096
+
+
+def index_path(filename):
+    return f"{filename}.idx"
+
+
+class CaptureWriter:
+    """
+    Append received chunks to a capture file.
+    The header holds the wall-clock start in nanoseconds since the epoch and every record
+    is (nanoseconds since start on the monotonic clock, length, data). Every INDEX_INTERVAL
+    records the (timestamp, file offset) of a record is appended to <filename>.idx for seeking.
+    Both files are flushed every flush_records records, and by write() or flush_due() once
+    flush_interval seconds have passed with records unflushed, so a crash loses little.
+    """
+
+    def __init__(self, filename, index_interval=INDEX_INTERVAL, flush_interval=FLUSH_INTERVAL,
+                 flush_records=FLUSH_RECORDS):
+        self.filename = filename
+        self.index_interval = index_interval
+        self.flush_interval = flush_interval
+        self.flush_records = flush_records
+        self.start_ns = time.monotonic_ns()
+        self.wall_start_ns = time.time_ns()
+        self.records = 0
+        self.bytes = 0
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        self._fh = open(filename, "wb")
+        self._idx = open(index_path(filename), "wb")
+        self._fh.write(HEADER.pack(MAGIC, VERSION, self.wall_start_ns))
+        self._fh.flush()
+
+    def write(self, data: bytes, ts_ns=None):
+        """Record data as received at monotonic time ts_ns (default: now)."""
+        if not data:
+            return
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        rel = max(0, ts_ns - self.start_ns)
+        if self.records % self.index_interval == 0:
+            self._idx.write(INDEX_ENTRY.pack(rel, self._fh.tell()))
+        self._fh.write(RECORD.pack(rel, len(data)))
+        self._fh.write(data)
+        self.records += 1
+        self.bytes += len(data)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_records:
+            self.flush()
+        else:
+            self.flush_due()
+
+    def flush_due(self):
+        """Flush if records have waited flush_interval seconds; cheap enough to call on every idle poll."""
+        if self._unflushed and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._fh.flush()
+        self._idx.flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self._fh.close()
+        self._idx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """
+    Read a capture file written by CaptureWriter.
+    Iterating yields (nanoseconds since start, data) per record; seek() jumps to the first
+    record at or after a timestamp using the index, which is rebuilt when missing or stale.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fh = open(filename, "rb")
+        magic, version, self.wall_start_ns = HEADER.unpack(self._fh.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a serial capture")
+        if version != VERSION:
+            raise ValueError(f"{filename}: unsupported capture version {version}")
+        self._index = None
+
+    def __iter__(self):
+        read = self._fh.read
+        while True:
+            head = read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            ts, size = RECORD.unpack(head)
+            data = read(size)
+            if len(data) < size:
+                # the writer was killed mid-record
+                return
+            yield ts, data
+
+    def rewind(self):
+        self._fh.seek(HEADER.size)
+
+    def load_index(self):
+        """Return the index as two lists (timestamps, offsets), rebuilding it if it does not fit the file."""
+        if self._index is not None:
+            return self._index
+        ts, offsets = [], []
+        try:
+            with open(index_path(self.filename), "rb") as fh:
+                for t, off in INDEX_ENTRY.iter_unpack(fh.read()):
+                    ts.append(t)
+                    offsets.append(off)
+        except (OSError, struct.error):
+            ts = []
+        if not ts or offsets[-1] >= os.path.getsize(self.filename):
+            ts, offsets = build_index(self.filename)
+        self._index = ts, offsets
+        return self._index
+
+    def seek(self, ts_ns):
+        """Position the reader at the first record with a timestamp of at least ts_ns."""
+        ts, offsets = self.load_index()
+        i = bisect.bisect_right(ts, ts_ns) - 1
+        self._fh.seek(offsets[i] if i >= 0 else HEADER.size)
+        while True:
+            pos = self._fh.tell()
+            head = self._fh.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            t, size = RECORD.unpack(head)
+            if t >= ts_ns:
+                self._fh.seek(pos)
+                return
+            self._fh.seek(size, io.SEEK_CUR)
+
+    def info(self):
+        self.rewind()
+        records = size = 0
+        first = last = 0
+        for ts, data in self:
+            if not records:
+                first = ts
+            last = ts
+            records += 1
+            size += len(data)
+        return {"start": self.wall_start_ns, "first_ns": first, "last_ns": last, "records": records, "bytes": size}
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_index(filename, index_interval=INDEX_INTERVAL):
+    """Scan filename, write <filename>.idx and return it as (timestamps, offsets)."""
+    ts, offsets = [], []
+    with open(filename, "rb") as fh:
+        fh.seek(HEADER.size)
+        n = 0
+        while True:
+            pos = fh.tell()
+            head = fh.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break
+            t, size = RECORD.unpack(head)
+            if n % index_interval == 0:
+                ts.append(t)
+                offsets.append(pos)
+            fh.seek(size, io.SEEK_CUR)
+            n += 1
+    with open(index_path(filename), "wb") as fh:
+        for entry in zip(ts, offsets):
+            fh.write(INDEX_ENTRY.pack(*entry))
+    return ts, offsets
+
+
+def fmt_wall(ns):
+    dt = datetime.datetime.fromtimestamp(ns / 1e9)
+    return dt.strftime("%Y-%m-%d %H:%M:%S.") + f"{dt.microsecond // 1000:03d}"
+
+
+def capture_lines(filename):
+    """
+    Yield the received bytes of filename split into lines, each prefixed with
+    `[<date> <time> RX] ` at the wall-clock time its first byte arrived.
+    """
+    with CaptureReader(filename) as cap:
+        start = cap.wall_start_ns
+        pending = bytearray()
+        pending_ts = 0
+        for ts, data in cap:
+            pos = 0
+            while pos < len(data):
+                if not pending:
+                    pending_ts = ts
+                nl = data.find(b"\n", pos)
+                if nl < 0:
+                    pending += data[pos:]
+                    break
+                pending += data[pos:nl + 1]
+                yield f"[{fmt_wall(start + pending_ts)} RX] ".encode() + bytes(pending)
+                pending.clear()
+                pos = nl + 1
+        if pending:
+            yield f"[{fmt_wall(start + pending_ts)} RX] ".encode() + bytes(pending) + b"\n"
+
+
+class CaptureText(io.RawIOBase):
+    """Binary stream over capture_lines(), for readers that expect a text log."""
+
+    def __init__(self, filename):
+        self._lines = capture_lines(filename)
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            self._buf = next(self._lines, None)
+            if self._buf is None:
+                self._buf = b""
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def close(self):
+        self._lines.close()
+        super().close()
+
+
+def open_capture_text(filename):
+    return io.BufferedReader(CaptureText(filename))
+
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        try:
+            n = os.write(fd, view)
+        except BlockingIOError:
+            select.select([], [fd], [])
+            continue
+        view = view[n:]
+
+
+def replay(filename, fd, speed=1.0, start_ns=0):
+    """
+    Write the records of filename from start_ns on into fd.
+    speed scales the original inter-record timing, 0 writes everything as fast as possible.
+    Returns a dict of records, bytes, seconds and, for timed replay, lateness statistics in nanoseconds.
+    """
+    if speed < 0:
+        raise ValueError("speed must be >= 0")
+    late = RunningStats()
+    records = size = 0
+    with CaptureReader(filename) as cap:
+        if start_ns:
+            cap.seek(start_ns)
+        t0 = time.perf_counter_ns()
+        first = None
+        if speed == 0:
+            batch = bytearray()
+            for _, data in cap:
+                batch += data
+                records += 1
+                if len(batch) >= REPLAY_CHUNK:
+                    write_all(fd, batch)
+                    size += len(batch)
+                    batch.clear()
+            write_all(fd, batch)
+            size += len(batch)
+        else:
+            for ts, data in cap:
+                if first is None:
+                    first = ts
+                due = t0 + (ts - first) / speed
+                now = time.perf_counter_ns()
+                if due > now:
+                    time.sleep((due - now) / 1e9)
+                    now = time.perf_counter_ns()
+                late.add(max(0, now - due))
+                write_all(fd, data)
+                records += 1
+                size += len(data)
+    secs = (time.perf_counter_ns() - t0) / 1e9
+    return {"records": records, "bytes": size, "seconds": secs, "late_ns": late if speed else None}
+
+
+def open_pty():
+    """Open a raw pseudo-terminal pair and return (master fd, slave fd, slave path)."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def format_replay(res):
+    rate = res["bytes"] / res["seconds"] if res["seconds"] else float("inf")
+    out = f"replayed {res['records']} records, {res['bytes']} bytes in {res['seconds']:.3f} s ({rate:,.0f} B/s)"
+    if res["late_ns"] is not None and res["late_ns"].count:
+        late = res["late_ns"]
+        out += f"\nlateness: mean {late.mean / 1e6:.3f} ms, max {late.max / 1e6:.3f} ms"
+    return out
+
+
+def format_info(filename, info):
+    secs = (info["last_ns"] - info["first_ns"]) / 1e9
+    return (f"{filename}: started {fmt_wall(info['start'])}, {info['records']} records, "
+            f"{info['bytes']} bytes over {secs:.3f} s")
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(USAGE)
+        sys.exit(0)
+    flag, fn = sys.argv[1], sys.argv[2]
+    if flag == "-i":
+        with CaptureReader(fn) as cap:
+            res = format_info(fn, cap.info())
+    elif flag == "-d":
+        for line in capture_lines(fn):
+            sys.stdout.write(line.decode("latin-1"))
+        res = ""
+    elif flag == "-p":
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        master, slave, path = open_pty()
+        try:
+            input(f"replay into {path}, press Enter to start ")
+            res = format_replay(replay(fn, master, speed))
+            input(f"{res}\npress Enter to close {path} ")
+        finally:
+            os.close(master)
+            os.close(slave)
+    elif flag == "-x":
+        res = f"{index_path(fn)}: {len(build_index(fn)[0])} entries"
+    else:
+        print(USAGE)
+        sys.exit(0)
+    return res
+
+
+if __name__ == "__main__":
+    result = main()
+    if result:
+        print(result)
@@ -1,27 +1,64 @@
+import asyncio
+import atexit
+import codecs
 import datetime
 import logging
+import logging.handlers
+import os
+import queue
+import re
+import select
 import serial
 import sys
 import threading
 import time
+from collections import deque
+
+from logparse import RunningStats, format_report, latency_stats, pop_flag, pop_opt
+from serial_capture import CaptureWriter
 
 
 TODAY = datetime.datetime.now().strftime("%m-%d-%Y")
 MAX_BUFFER_SIZE = 4096
+RING_SIZE = MAX_BUFFER_SIZE * 64
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+STOP_POLL_INTERVAL = 0.2
+ASYNC_READ_LIMIT = 64 * 1024
+ASYNC_WRITE_HIGH_WATER = 64 * 1024
+ASYNC_WRITE_LOW_WATER = 16 * 1024
+MUX_FLUSH_INTERVAL = 0.05
+MUX_PARTIAL_TIMEOUT = 0.2
+ROUNDTRIP_TIMEOUT = 2.0
+SCRIPT_KEYWORDS = ("send", "expect", "timeout", "sleep")
+OUTPUT_FLUSH_INTERVAL = 0.05
 
-logging.basicConfig(
-    filename=f"serial_com_{TODAY}_{int(time.time())}.log",
-    filemode="a",
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    level=logging.DEBUG,
-)
+# records are queued by the calling thread and written to the file by a listener thread,
+# so a slow disk never stalls the serial reader
+log_queue = queue.SimpleQueue()
+log_handler = logging.FileHandler(f"serial_com_{TODAY}_{int(time.time())}.log", mode="a")
+log_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+logging.basicConfig(level=logging.DEBUG, format="%(message)s", handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 
+def encode_line(line: str, cr=True, lf=True) -> bytes:
+    suffix = ""
+    if cr:
+        suffix += "\r"
+    if lf:
+        suffix += "\n"
+    return (line + suffix).encode()
+
+
 class SerialPort:
+    """A tty path or any pyserial URL, e.g. loop:// or socket://host:port."""
+
     def __init__(self, device, baud, timeout=0, rtscts=False, dsrdtr=False):
         self.device = device
-        self.port = serial.Serial(
+        self.port = serial.serial_for_url(
             device,
             baudrate=baud,
             timeout=timeout,
@@ -33,12 +70,7 @@ class SerialPort:
         self.port.write(data)
 
     def write_line(self, line: str, cr=True, lf=True):
-        suffix = ""
-        if cr:
-            suffix += "\r"
-        if lf:
-            suffix += "\n"
-        self.write((line + suffix).encode())
+        self.write(encode_line(line, cr, lf))
 
     def read_available(self):
         """Read all currently available bytes."""
@@ -46,76 +78,1088 @@ class SerialPort:
             return self.port.read(self.port.in_waiting)
         return b""
 
+    def read_blocking(self, timeout):
+        """Block up to timeout seconds for the first byte, then read everything available."""
+        old_timeout = self.port.timeout
+        self.port.timeout = timeout
+        try:
+            data = self.port.read(1)
+        finally:
+            self.port.timeout = old_timeout
+        if data:
+            data += self.read_available()
+        return data
+
+    def readinto_views(self, views):
+        """
+        Read straight into the writable memoryviews in views and return the number of bytes read.
+        On POSIX this is a single readv() on the descriptor, so nothing is copied on the way.
+        """
+        fd = self.fileno()
+        if fd is not None:
+            try:
+                return os.readv(fd, views)
+            except BlockingIOError:
+                return 0
+            except OSError as e:
+                raise serial.SerialException(f"read failed: {e}")
+        n = 0
+        for view in views:
+            got = self.port.readinto(view) or 0
+            n += got
+            if got < len(view):
+                break
+        return n
+
+    def discard(self, size):
+        """Read and throw away up to size bytes, returning how many were read."""
+        return len(self.port.read(size))
+
+    def fileno(self):
+        """Return the port's file descriptor, or None where it cannot be polled (Windows, most URLs)."""
+        try:
+            return self.port.fileno()
+        except (AttributeError, NotImplementedError, OSError, serial.SerialException):
+            return None
+
     def close(self):
         if self.port.is_open:
             self.port.close()
 
 
+class RingBuffer:
+    """
+    Preallocated byte ring between one producer and one consumer thread.
+    fill() lets the producer read straight into memoryviews of the free space and
+    drain() hands the consumer everything buffered as one batch. When the incoming
+    bytes do not fit, policy decides:
+        block:       the producer waits until the consumer frees space.
+        drop_oldest: the oldest unread bytes are discarded to make room.
+        drop_newest: incoming bytes that do not fit are read and discarded.
+    bytes_in, bytes_out, dropped, overflows and high_water count what happened.
+    """
+
+    def __init__(self, size=RING_SIZE, policy="block"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("policy must be one of {}".format(OVERFLOW_POLICIES))
+        self.size = size
+        self.policy = policy
+        self._view = memoryview(bytearray(size))
+        self._head = 0
+        self._tail = 0
+        self._cond = threading.Condition()
+        self.closed = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def _free_views(self, n):
+        start = self._head % self.size
+        first = min(n, self.size - start)
+        views = [self._view[start:start + first]]
+        if n > first:
+            views.append(self._view[:n - first])
+        return views
+
+    def fill(self, readinto, want, discard=None):
+        """
+        Make room for want bytes according to the policy, call readinto(views) on the free
+        space and commit what it read. Bytes that do not fit under drop_newest go to
+        discard(n). Returns the number of bytes taken from the source, stored or dropped.
+        """
+        with self._cond:
+            free = self.size - len(self)
+            if free < want:
+                self.overflows += 1
+                if self.policy == "block":
+                    while free == 0 and not self.closed:
+                        self._cond.wait()
+                        free = self.size - len(self)
+                elif self.policy == "drop_oldest":
+                    drop = min(want, self.size) - free
+                    self._tail += drop
+                    self.dropped += drop
+                    free += drop
+            if self.closed:
+                return 0
+            views = self._free_views(min(want, free))
+        n = readinto(views) if views[0] else 0
+        extra = 0
+        if self.policy == "drop_newest" and want > n == sum(len(v) for v in views) and discard is not None:
+            extra = discard(want - n)
+        with self._cond:
+            self._head += n
+            self.bytes_in += n
+            self.dropped += extra
+            self.high_water = max(self.high_water, len(self))
+            self._cond.notify_all()
+        return n + extra
+
+    def put(self, data):
+        """
+        fill() from a bytes object until all of data is stored or dropped, so under block it
+        waits for the consumer as often as needed. Returns len(data), or less if the ring closed.
+        """
+        data = memoryview(data)
+        pos = 0
+
+        def copy(views):
+            n = 0
+            for view in views:
+                view[:] = data[pos + n:pos + n + len(view)]
+                n += len(view)
+            return n
+
+        while pos < len(data):
+            n = self.fill(copy, len(data) - pos, lambda n: n)
+            if n == 0:
+                break
+            pos += n
+        return pos
+
+    def drain(self, max_bytes=None, timeout=None):
+        """
+        Wait up to timeout seconds for data and return up to max_bytes of it as one bytes object.
+        Returns b"" on timeout and None once the ring is closed and empty.
+        """
+        with self._cond:
+            if not len(self) and not self.closed:
+                self._cond.wait(timeout)
+            n = len(self) if max_bytes is None else min(max_bytes, len(self))
+            if n == 0:
+                return None if self.closed else b""
+            start = self._tail % self.size
+            first = min(n, self.size - start)
+            data = b"".join((self._view[start:start + first], self._view[:n - first]))
+            self._tail += n
+            self.bytes_out += n
+            self._cond.notify_all()
+        return data
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def summary(self):
+        return (f"ring buffer ({self.policy}, {self.size} bytes): in={self.bytes_in} out={self.bytes_out} "
+                f"dropped={self.dropped} overflows={self.overflows} high_water={self.high_water}")
+
+
+class OutputWriter(threading.Thread):
+    """
+    Writer stage fed by a RingBuffer: drains received bytes in batches, decodes them with an
+    incremental decoder so characters split across reads come out whole, and writes them to
+    out and the raw bytes to log_fh (both binary streams, out defaults to stdout). Both are
+    flushed at most every flush_interval seconds, and once the ring is closed and empty.
+    """
+
+    def __init__(self, ring: RingBuffer, out=None, log_fh=None, flush_interval=OUTPUT_FLUSH_INTERVAL, encoding="utf-8"):
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.out = out if out is not None else sys.stdout.buffer
+        self.log_fh = log_fh
+        self.flush_interval = flush_interval
+        self.out_encoding = getattr(sys.stdout, "encoding", None) or "utf-8"
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.batches = 0
+        self.flushes = 0
+
+    def write(self, data: bytes, final=False):
+        text = self.decoder.decode(data, final)
+        if text:
+            self.out.write(text.encode(self.out_encoding, errors="replace"))
+        if self.log_fh is not None and data:
+            self.log_fh.write(data)
+
+    def flush(self):
+        self.out.flush()
+        if self.log_fh is not None:
+            self.log_fh.flush()
+        self.flushes += 1
+
+    def run(self):
+        sys.stdout.flush()
+        dirty = False
+        last_flush = time.monotonic()
+        try:
+            while True:
+                wait = STOP_POLL_INTERVAL
+                if dirty:
+                    wait = max(0, last_flush + self.flush_interval - time.monotonic())
+                data = self.ring.drain(timeout=wait)
+                if data is None:
+                    break
+                if data:
+                    self.write(data)
+                    self.batches += 1
+                    dirty = True
+                if dirty and time.monotonic() - last_flush >= self.flush_interval:
+                    self.flush()
+                    dirty = False
+                    last_flush = time.monotonic()
+        finally:
+            self.write(b"", final=True)
+            self.flush()
+
+
 class SerialReader(threading.Thread):
-    def __init__(self, ser: SerialPort, stop_event: threading.Event):
+    """
+    Reads the port into a RingBuffer as soon as bytes arrive by blocking in select() on
+    its descriptor, or in a read with timeout where the port has none. stop() wakes the
+    thread at once through a pipe and closes the ring; setting stop_event alone is noticed
+    within STOP_POLL_INTERVAL. wake_stats holds the nanoseconds from select() waking to
+    the data being in the ring. With a CaptureWriter every chunk read from the port is
+    also recorded with its arrival time, including bytes the ring drops.
+    """
+
+    def __init__(self, ser: SerialPort, stop_event: threading.Event, ring: RingBuffer = None, capture=None):
         super().__init__(daemon=True)
         self.ser = ser
         self.stop_event = stop_event
+        self.ring = ring if ring is not None else RingBuffer()
+        self.capture = capture
+        self.wake_stats = RunningStats()
+        self._wake_r, self._wake_w = os.pipe()
+        self._wake_lock = threading.Lock()
+
+    def stop(self):
+        self.stop_event.set()
+        self.ring.close()
+        with self._wake_lock:
+            # None once run() has closed the pipe, whose descriptor numbers may be reused by now
+            if self._wake_w is not None:
+                os.write(self._wake_w, b"\0")
+
+    def _close_wake(self):
+        with self._wake_lock:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = self._wake_w = None
+
+    def _readinto(self, views):
+        n = self.ser.readinto_views(views)
+        if n:
+            ts = time.monotonic_ns()
+            self.capture.write(b"".join(views)[:n], ts)
+        return n
+
+    def _discard(self, size):
+        data = self.ser.port.read(size)
+        self.capture.write(data)
+        return len(data)
+
+    def read(self, fd):
+        if fd is None:
+            data = self.ser.read_blocking(STOP_POLL_INTERVAL)
+            if data:
+                if self.capture is not None:
+                    self.capture.write(data)
+                self.ring.put(data)
+            return
+        ready, _, _ = select.select([fd, self._wake_r], [], [], STOP_POLL_INTERVAL)
+        if fd not in ready:
+            return
+        t0 = time.perf_counter_ns()
+        want = min(self.ser.port.in_waiting, self.ring.size) or 1
+        if self.capture is None:
+            n = self.ring.fill(self.ser.readinto_views, want, self.ser.discard)
+        else:
+            n = self.ring.fill(self._readinto, want, self._discard)
+        if n == 0 and not self.stop_event.is_set():
+            raise serial.SerialException("device reports readiness to read but returned no data")
+        self.wake_stats.add(time.perf_counter_ns() - t0)
+
+    def wake_summary(self):
+        s = self.wake_stats
+        if s.count == 0:
+            return "wake-to-read latency: no reads"
+        return (f"wake-to-read latency: count={s.count} min={s.min / 1000:.1f}us "
+                f"mean={s.mean / 1000:.1f}us max={s.max / 1000:.1f}us")
 
     def run(self):
         logger.info("Serial reader thread started")
-        while not self.stop_event.is_set():
+        fd = self.ser.fileno()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.read(fd)
+                except (serial.SerialException, OSError) as e:
+                    logger.error(f"Serial error: {e}")
+                    break
+                if self.capture is not None:
+                    self.capture.flush_due()
+        finally:
+            self.ring.close()
+            self._close_wake()
+        logger.info(self.wake_summary())
+        logger.info(self.ring.summary())
+        logger.info("Serial reader thread exiting")
+
+
+class AsyncSerialPort:
+    """
+    asyncio counterpart of SerialPort, to be created inside a running event loop.
+    pyserial only opens and configures the port; its descriptor is then set non-blocking
+    and registered with the loop, so any number of ports share one thread.
+    Reading stops while more than read_limit bytes are buffered and resumes as they are
+    consumed. write() queues what the descriptor does not take at once and drain() waits
+    while more than ASYNC_WRITE_HIGH_WATER bytes are queued, like asyncio.StreamWriter.
+    """
+
+    def __init__(self, device, baud, rtscts=False, dsrdtr=False, read_limit=ASYNC_READ_LIMIT):
+        self.device = device
+        self.port = serial.Serial(
+            device,
+            baudrate=baud,
+            timeout=0,
+            write_timeout=0,
+            rtscts=rtscts,
+            dsrdtr=dsrdtr,
+        )
+        self.fd = self.port.fileno()
+        os.set_blocking(self.fd, False)
+        self.read_limit = read_limit
+        self._loop = asyncio.get_running_loop()
+        self._rbuf = bytearray()
+        self._wbuf = bytearray()
+        self._read_waiter = None
+        self._drain_waiter = None
+        self._reading = False
+        self._writing = False
+        self._eof = False
+        self._exc = None
+        self._resume_reading()
+
+    def _resume_reading(self):
+        if not self._reading and not self._eof and self._exc is None:
+            self._loop.add_reader(self.fd, self._on_readable)
+            self._reading = True
+
+    def _pause_reading(self):
+        if self._reading:
+            self._loop.remove_reader(self.fd)
+            self._reading = False
+
+    def _wake(self, waiter):
+        if waiter is not None and not waiter.done():
+            if self._exc is not None:
+                waiter.set_exception(self._exc)
+            else:
+                waiter.set_result(None)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, MAX_BUFFER_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._set_exception(serial.SerialException(f"read failed: {e}"))
+            return
+        if not data:
+            self._eof = True
+            self._pause_reading()
+        self._rbuf += data
+        if len(self._rbuf) >= self.read_limit:
+            self._pause_reading()
+        self._wake(self._read_waiter)
+
+    def _on_writable(self):
+        try:
+            n = os.write(self.fd, self._wbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._set_exception(serial.SerialException(f"write failed: {e}"))
+            return
+        del self._wbuf[:n]
+        if not self._wbuf:
+            self._loop.remove_writer(self.fd)
+            self._writing = False
+        if len(self._wbuf) <= ASYNC_WRITE_LOW_WATER:
+            self._wake(self._drain_waiter)
+
+    def _set_exception(self, exc):
+        self._exc = exc
+        self._pause_reading()
+        if self._writing:
+            self._loop.remove_writer(self.fd)
+            self._writing = False
+        self._wake(self._read_waiter)
+        self._wake(self._drain_waiter)
+
+    async def _wait_for_data(self):
+        if self._exc is not None:
+            raise self._exc
+        if self._read_waiter is not None:
+            raise RuntimeError("another coroutine is already waiting for data")
+        self._resume_reading()
+        self._read_waiter = self._loop.create_future()
+        try:
+            await self._read_waiter
+        finally:
+            self._read_waiter = None
+
+    def _consume(self, n):
+        data = bytes(self._rbuf[:n])
+        del self._rbuf[:n]
+        if len(self._rbuf) < self.read_limit:
+            self._resume_reading()
+        return data
+
+    async def read(self, n=-1) -> bytes:
+        """Wait for data and return up to n bytes (all buffered bytes if n < 0); b"" at EOF."""
+        while not self._rbuf and not self._eof:
+            await self._wait_for_data()
+        return self._consume(len(self._rbuf) if n < 0 else n)
+
+    async def readuntil(self, separator=b"\n") -> bytes:
+        """Return the data up to and including separator. Raises asyncio.IncompleteReadError at EOF."""
+        start = 0
+        while True:
+            i = self._rbuf.find(separator, start)
+            if i >= 0:
+                return self._consume(i + len(separator))
+            if self._eof:
+                raise asyncio.IncompleteReadError(self._consume(len(self._rbuf)), None)
+            start = max(0, len(self._rbuf) - len(separator) + 1)
+            await self._wait_for_data()
+
+    async def readline(self) -> bytes:
+        """Return one line including b"\n", or the remaining bytes at EOF."""
+        try:
+            return await self.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    def write(self, data: bytes):
+        if self._exc is not None:
+            raise self._exc
+        if not self._wbuf:
             try:
-                data = self.ser.read_available()
-                if data:
-                    sys.stdout.write(data.decode(errors="replace"))
-                    sys.stdout.flush()
+                n = os.write(self.fd, data)
+            except (BlockingIOError, InterruptedError):
+                n = 0
+            data = data[n:]
+        if data:
+            self._wbuf += data
+            if not self._writing:
+                self._loop.add_writer(self.fd, self._on_writable)
+                self._writing = True
+
+    def write_line(self, line: str, cr=True, lf=True):
+        self.write(encode_line(line, cr, lf))
+
+    async def drain(self):
+        """Wait until the write queue is below ASYNC_WRITE_LOW_WATER if it grew past ASYNC_WRITE_HIGH_WATER."""
+        if self._exc is not None:
+            raise self._exc
+        if len(self._wbuf) <= ASYNC_WRITE_HIGH_WATER:
+            return
+        self._drain_waiter = self._loop.create_future()
+        try:
+            await self._drain_waiter
+        finally:
+            self._drain_waiter = None
+
+    def close(self):
+        self._pause_reading()
+        if self._writing:
+            self._loop.remove_writer(self.fd)
+            self._writing = False
+        if self.port.is_open:
+            self.port.close()
+
+
+def read_stdin_lines(loop, lines: asyncio.Queue):
+    """
+    Put the lines typed on stdin into lines, and None at end of input, reading from the
+    loop rather than an executor thread, which would keep asyncio.run from returning
+    until the next line is typed. Returns a function that stops reading.
+    """
+    stdin_fd = sys.stdin.fileno()
+    partial = b""
+
+    def on_stdin():
+        nonlocal partial
+        data = os.read(stdin_fd, MAX_BUFFER_SIZE)
+        if not data:
+            loop.remove_reader(stdin_fd)
+            lines.put_nowait(None)
+            return
+        *complete, partial = (partial + data).split(b"\n")
+        for line in complete:
+            lines.put_nowait(line.decode(errors="replace"))
+
+    loop.add_reader(stdin_fd, on_stdin)
+    return lambda: loop.remove_reader(stdin_fd)
+
+
+async def console_async(tty, baudrate, rtscts=False, cr=True, lf=True, capture=None, output=None):
+    """
+    Interactive console on AsyncSerialPort: port output and stdin lines run as two tasks.
+    Received chunks are handed to output (a running OutputWriter, one is started if not given)
+    and recorded to capture (a CaptureWriter) when given.
+    """
+    loop = asyncio.get_running_loop()
+    ser = AsyncSerialPort(tty, baudrate, rtscts=rtscts)
+    if output is None:
+        output = OutputWriter(RingBuffer())
+        output.start()
+
+    async def pump_output():
+        while True:
+            data = await ser.read()
+            if not data:
+                break
+            if capture is not None:
+                capture.write(data)
+            output.ring.put(data)
+
+    async def flush_capture():
+        while True:
+            await asyncio.sleep(capture.flush_interval)
+            capture.flush_due()
+
+    lines = asyncio.Queue()
+    flusher = asyncio.create_task(flush_capture()) if capture is not None else None
+    pump = asyncio.create_task(pump_output())
+    pump.add_done_callback(lambda _: lines.put_nowait(None))
+    stop_stdin = read_stdin_lines(loop, lines)
+    try:
+        while True:
+            line = await lines.get()
+            if line is None:
+                break
+            ser.write_line(line.rstrip("\r"), cr=cr, lf=lf)
+            await ser.drain()
+    finally:
+        stop_stdin()
+        pump.cancel()
+        if flusher is not None:
+            flusher.cancel()
+        ser.close()
+        output.ring.close()
+        output.join(timeout=1)
+        print("\nSerial port closed.")
+
+
+def parse_endline(nl):
+    """Return (cr, lf) for an endline option, or None if it is not one of cr | lf | crlf | no_crlf."""
+    return {"crlf": (True, True), "cr": (True, False), "lf": (False, True), "no_crlf": (False, False)}.get(nl)
+
+
+def device_path(tty):
+    if sys.platform in ("linux", "darwin"):
+        return f"/dev/{tty}"
+    return tty
+
+
+class SerialMux:
+    """
+    Monitor many ports from one event loop. Every line is tagged with its port and the
+    monotonic time its first byte was read, and written to out and to one merged log.
+    Output is batched every MUX_FLUSH_INTERVAL; a line without a newline is emitted once
+    its port has been quiet for MUX_PARTIAL_TIMEOUT so prompts still show up.
+    """
+
+    def __init__(self, ports: dict, out=sys.stdout, log_fh=None):
+        self.ports = ports
+        self.out = out
+        self.log_fh = log_fh
+        self.t0 = time.monotonic()
+        self.bytes_in = dict.fromkeys(ports, 0)
+        self.lines_in = dict.fromkeys(ports, 0)
+        self._pending = []
+
+    def emit(self, ts, tag, line: bytes):
+        self.lines_in[tag] += 1
+        text = line.rstrip(b"\r").decode(errors="replace")
+        self._pending.append(f"{ts - self.t0:12.6f} [{tag}] {text}\n")
+
+    def flush(self):
+        if not self._pending:
+            return
+        chunk = "".join(self._pending)
+        self._pending.clear()
+        self.out.write(chunk)
+        self.out.flush()
+        if self.log_fh is not None:
+            self.log_fh.write(chunk)
+
+    async def pump(self, tag, port: AsyncSerialPort):
+        partial = b""
+        partial_ts = None
+        while True:
+            try:
+                if partial:
+                    data = await asyncio.wait_for(port.read(), MUX_PARTIAL_TIMEOUT)
                 else:
-                    time.sleep(0.01)
+                    data = await port.read()
+            except asyncio.TimeoutError:
+                self.emit(partial_ts, tag, partial)
+                partial = b""
+                continue
             except serial.SerialException as e:
-                logger.error(f"Serial error: {e}")
+                logger.error(f"{tag}: {e}")
                 break
-        logger.info("Serial reader thread exiting")
+            now = time.monotonic()
+            if not data:
+                break
+            self.bytes_in[tag] += len(data)
+            line_ts = partial_ts if partial else now
+            *lines, partial = (partial + data).split(b"\n")
+            for line in lines:
+                self.emit(line_ts, tag, line)
+                line_ts = now
+            partial_ts = line_ts if partial else None
+        if partial:
+            self.emit(partial_ts, tag, partial)
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(MUX_FLUSH_INTERVAL)
+            self.flush()
+
+    def send(self, line: str, cr=True, lf=True):
+        """Send line to every port, or to one port when it starts with `@<tag> `."""
+        targets = self.ports
+        if line.startswith("@"):
+            tag, _, line = line[1:].partition(" ")
+            if tag not in self.ports:
+                print(f"unknown port {tag}, ports: {', '.join(self.ports)}")
+                return
+            targets = {tag: self.ports[tag]}
+        for port in targets.values():
+            port.write_line(line, cr=cr, lf=lf)
+
+    def summary(self):
+        return "\n".join(f"{tag}: {self.bytes_in[tag]} bytes, {self.lines_in[tag]} lines" for tag in self.ports)
+
+
+async def monitor_async(ttys, baudrate, rtscts=False, cr=True, lf=True, log_path=None):
+    loop = asyncio.get_running_loop()
+    ports = {}
+    log_fh = open(log_path, "a", encoding="utf-8") if log_path else None
+    try:
+        for tty in ttys:
+            ports[tty] = AsyncSerialPort(device_path(tty), baudrate, rtscts=rtscts)
+        mux = SerialMux(ports, log_fh=log_fh)
+        tasks = [asyncio.create_task(mux.pump(tag, port)) for tag, port in ports.items()]
+        flusher = asyncio.create_task(mux.flush_loop())
+        print(f"Monitoring {', '.join(ports)} @ {baudrate}")
+        print("Lines are sent to every port, prefix with @<port> to target one. Ctrl+C to exit\n")
+        lines = asyncio.Queue()
+        pumps = asyncio.gather(*tasks)
+        pumps.add_done_callback(lambda _: lines.put_nowait(None))
+        stop_stdin = read_stdin_lines(loop, lines)
+        try:
+            while True:
+                line = await lines.get()
+                if line is None:
+                    await pumps
+                    break
+                mux.send(line.rstrip("\r"), cr=cr, lf=lf)
+        finally:
+            stop_stdin()
+            for t in tasks:
+                t.cancel()
+            flusher.cancel()
+            mux.flush()
+            print(f"\n{mux.summary()}")
+    finally:
+        for port in ports.values():
+            port.close()
+        if log_fh is not None:
+            log_fh.close()
+
+
+def monitor_main(argv):
+    """serial_com.py -m <tty> [<tty> ...] [-b baudrate] [-r rtscts] [-e endline] [-o merged_log]"""
+    baudrate = int(pop_opt(argv, "-b", 115200))
+    rtscts = bool(int(pop_opt(argv, "-r", 0)))
+    endline = parse_endline(pop_opt(argv, "-e", "crlf"))
+    log_path = pop_opt(argv, "-o", f"serial_mux_{TODAY}_{int(time.time())}.log")
+    ttys = argv[2:]
+    if not ttys or endline is None:
+        print(monitor_main.__doc__)
+        sys.exit(1)
+    try:
+        asyncio.run(monitor_async(ttys, baudrate, rtscts, *endline, log_path))
+    except KeyboardInterrupt:
+        pass
+
+
+def compile_expect(pattern=None, terminator=None):
+    """Return a bytes regex matching a response: pattern as a regex, or terminator as a literal (default a newline)."""
+    if pattern is not None:
+        return re.compile(pattern.encode())
+    return re.compile(re.escape((terminator or "\n").encode()))
+
+
+def roundtrip(ser: SerialPort, data: bytes, expect, timeout=ROUNDTRIP_TIMEOUT):
+    """
+    Send data and read until expect matches the bytes received since.
+    Returns (time to first byte, time to match, response) with times in nanoseconds from just
+    before the write, both taken with perf_counter_ns when the read returns; times are None
+    when nothing came back or the response did not match within timeout seconds.
+    """
+    fd = ser.fileno()
+    ser.port.reset_input_buffer()
+    buf = bytearray()
+    first = None
+    t0 = time.perf_counter_ns()
+    deadline = t0 + int(timeout * 1e9)
+    ser.write(data)
+    while True:
+        left = (deadline - time.perf_counter_ns()) / 1e9
+        if left <= 0:
+            return first, None, bytes(buf)
+        if fd is None:
+            chunk = ser.read_blocking(left)
+        else:
+            chunk = ser.read_available() if select.select([fd], [], [], left)[0] else b""
+        if not chunk:
+            continue
+        t = time.perf_counter_ns() - t0
+        if first is None:
+            first = t
+        buf += chunk
+        if expect.search(buf):
+            return first, t, bytes(buf)
+
+
+def read_commands(arg):
+    """A command string, or every non-empty line of file for @file."""
+    if not arg.startswith("@"):
+        return [arg]
+    with open(arg[1:], "r") as fh:
+        return [line.rstrip("\r\n") for line in fh if line.strip()]
+
+
+def format_roundtrips(command, ttfb, matched, timeouts):
+    lines = [f"{command!r}: {len(matched)} matched, {timeouts} timed out",
+             "time to first byte:",
+             format_report(ttfb, unit="us") if ttfb else "no response",
+             "time to matched response:",
+             format_report(matched, unit="us") if matched else "no match"]
+    return "\n".join(lines)
+
+
+def latency_main(argv):
+    """
+    serial_com.py -l <tty> <command | @file> [-n count] [-x regex | -z terminator] [-w timeout]
+                  [-i interval] [-b baudrate] [-r rtscts] [-e endline]
+    """
+    count = int(pop_opt(argv, "-n", 100))
+    pattern = pop_opt(argv, "-x")
+    terminator = pop_opt(argv, "-z")
+    timeout = float(pop_opt(argv, "-w", ROUNDTRIP_TIMEOUT))
+    interval = float(pop_opt(argv, "-i", 0))
+    baudrate = int(pop_opt(argv, "-b", 115200))
+    rtscts = bool(int(pop_opt(argv, "-r", 0)))
+    endline = parse_endline(pop_opt(argv, "-e", "crlf"))
+    if len(argv) != 4 or endline is None:
+        print(latency_main.__doc__)
+        sys.exit(1)
+    expect = compile_expect(pattern, terminator.encode().decode("unicode_escape") if terminator else None)
+    commands = read_commands(argv[3])
+    ser = SerialPort(device_path(argv[2]), baudrate, rtscts=rtscts)
+    results = {cmd: ([], [], 0) for cmd in commands}
+    try:
+        for _ in range(count):
+            for cmd in commands:
+                first, done, _ = roundtrip(ser, encode_line(cmd, *endline), expect, timeout)
+                ttfb, matched, timeouts = results[cmd]
+                if first is not None:
+                    ttfb.append(first // 1000)
+                if done is None:
+                    results[cmd] = ttfb, matched, timeouts + 1
+                else:
+                    matched.append(done // 1000)
+                if interval:
+                    time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ser.close()
+    print("\n\n".join(format_roundtrips(cmd, *res) for cmd, res in results.items()))
+
+
+class ScriptStep:
+    """One line sent (None for none) followed by the regexes expected in turn, or a pause of sleep seconds."""
+
+    def __init__(self, send=None, timeout=ROUNDTRIP_TIMEOUT, sleep=0):
+        self.send = send
+        self.expects = []
+        self.timeout = timeout
+        self.sleep = sleep
+
+    def __str__(self):
+        if self.sleep:
+            return f"sleep {self.sleep}"
+        return repr(self.send) if self.send is not None else "expect " + " ".join(p.pattern.decode() for p in self.expects)
+
+
+def parse_script(filename, timeout=ROUNDTRIP_TIMEOUT):
+    """
+    Read a send/expect script, one keyword and its argument per line:
+        send <line>        send <line> followed by the endline
+        expect <regex>     wait for <regex> in the output after the previous match
+        timeout <seconds>  timeout of the steps that follow, counted from their send
+        sleep <seconds>    wait for every outstanding step, then pause
+    Blank lines and lines starting with # are skipped. Every expect belongs to the send before
+    it; expects before the first send wait for output without sending anything.
+    Returns a list of ScriptStep.
+    """
+    steps = []
+    with open(filename, "r") as fh:
+        for lineno, line in enumerate(fh, start=1):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            keyword, _, arg = line.lstrip().partition(" ")
+            if keyword not in SCRIPT_KEYWORDS:
+                raise ValueError(f"{filename}:{lineno}: keyword must be one of {SCRIPT_KEYWORDS}")
+            if keyword == "send":
+                steps.append(ScriptStep(arg, timeout))
+            elif keyword == "expect":
+                if not steps or steps[-1].sleep:
+                    steps.append(ScriptStep(None, timeout))
+                steps[-1].expects.append(re.compile(arg.encode()))
+            elif keyword == "timeout":
+                timeout = float(arg)
+            else:
+                steps.append(ScriptStep(sleep=float(arg)))
+    return steps
+
+
+def run_script(ser: SerialPort, steps, depth=1, cr=True, lf=True):
+    """
+    Run steps on ser and return [(step, nanoseconds from send to the last expect matching or None)].
+    Up to depth steps are outstanding at a time: with depth > 1 the next line is sent without
+    waiting for the response to the previous one, and responses are matched in the order the
+    lines were sent. A sleep step waits for every outstanding step first. The script stops at
+    the first step whose expects do not all match within its timeout.
+    """
+    fd = ser.fileno()
+    ser.port.reset_input_buffer()
+    buf = bytearray()
+    pos = 0
+    pending = deque()
+    results = []
+    todo = deque(steps)
+    while todo or pending:
+        while todo and len(pending) < depth:
+            step = todo[0]
+            if step.sleep:
+                if pending:
+                    break
+                time.sleep(step.sleep)
+                todo.popleft()
+                continue
+            todo.popleft()
+            sent = time.perf_counter_ns()
+            if step.send is not None:
+                ser.write(encode_line(step.send, cr, lf))
+            pending.append([step, sent, 0])
+        if not pending:
+            continue
+        step, sent, i = head = pending[0]
+        while i < len(step.expects):
+            m = step.expects[i].search(buf, pos)
+            if m is None:
+                break
+            pos = m.end()
+            i += 1
+        head[2] = i
+        if i == len(step.expects):
+            results.append((step, time.perf_counter_ns() - sent))
+            pending.popleft()
+            if pos > MAX_BUFFER_SIZE:
+                del buf[:pos]
+                pos = 0
+            continue
+        left = (sent + int(step.timeout * 1e9) - time.perf_counter_ns()) / 1e9
+        if left <= 0:
+            results.append((step, None))
+            logger.error(f"script step {step} timed out waiting for {step.expects[i].pattern!r}, got {bytes(buf[pos:])!r}")
+            break
+        if fd is None:
+            buf += ser.read_blocking(left)
+        elif select.select([fd], [], [], left)[0]:
+            data = ser.read_available()
+            if not data:
+                # readable without bytes waiting: read() raises SerialException if the device is gone
+                data = ser.port.read(1)
+            buf += data
+    return results
+
+
+def format_script_results(runs, seconds):
+    """Per-step statistics in milliseconds over every run of a script, runs as returned by run_script."""
+    per_step = {}
+    failed = 0
+    for results in runs:
+        if results and results[-1][1] is None:
+            failed += 1
+        for n, (step, elapsed) in enumerate(results):
+            times, fails = per_step.setdefault(n, (step, [], 0))[1:]
+            if elapsed is None:
+                per_step[n] = (step, times, fails + 1)
+            else:
+                times.append(elapsed / 1e6)
+    lines = [f"{len(runs)} runs, {len(runs) - failed} passed, {failed} failed in {seconds:.3f} s "
+             f"({len(runs) / seconds if seconds else float('inf'):.1f} runs/s)",
+             f"{'step':>4}  {'ok':>6}  {'fail':>5}  {'p50 ms':>9}  {'p95 ms':>9}  {'max ms':>9}  send"]
+    for n, (step, times, fails) in sorted(per_step.items()):
+        stats = latency_stats(times)
+        if times:
+            cols = f"{stats['p50']:>9.3f}  {stats['p95']:>9.3f}  {stats['max']:>9.3f}"
+        else:
+            cols = f"{'-':>9}  {'-':>9}  {'-':>9}"
+        lines.append(f"{n + 1:>4}  {len(times):>6}  {fails:>5}  {cols}  {step}")
+    return "\n".join(lines)
+
+
+def script_main(argv):
+    """
+    serial_com.py -s <tty> <script> [-n count] [-P depth] [-w timeout] [-b baudrate] [-r rtscts] [-e endline]
+    """
+    count = int(pop_opt(argv, "-n", 1))
+    depth = int(pop_opt(argv, "-P", 1))
+    timeout = float(pop_opt(argv, "-w", ROUNDTRIP_TIMEOUT))
+    baudrate = int(pop_opt(argv, "-b", 115200))
+    rtscts = bool(int(pop_opt(argv, "-r", 0)))
+    endline = parse_endline(pop_opt(argv, "-e", "crlf"))
+    if len(argv) != 4 or endline is None or depth < 1:
+        print(script_main.__doc__)
+        sys.exit(1)
+    steps = parse_script(argv[3], timeout)
+    ser = SerialPort(device_path(argv[2]), baudrate, rtscts=rtscts)
+    runs = []
+    t0 = time.perf_counter()
+    try:
+        for _ in range(count):
+            runs.append(run_script(ser, steps, depth, *endline))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ser.close()
+    print(format_script_results(runs, time.perf_counter() - t0))
+    if any(results[-1][1] is None for results in runs if results):
+        sys.exit(1)
 
 
 def main():
     USAGE = """
     Usage:
-        serial_com.py <serial_name> [baudrate] [rtscts] [endline]
+        serial_com.py <serial_name> [baudrate] [rtscts] [endline] [--async] [--overflow policy] [--ring-size bytes]
+                      [--capture file] [--log file] [--flush seconds]
 
     Args:
         serial_name : tty device (e.g. ttyUSB0, COM3)
         baudrate    : default 115200
         rtscts      : 0 or 1
         endline     : cr | lf | crlf | no_crlf
+        --async     : run the console on asyncio instead of a reader thread (POSIX only)
+        --overflow  : block | drop_oldest | drop_newest, what the read buffer does when
+                      output falls behind (default block)
+        --ring-size : read buffer size in bytes (default 262144)
+        --capture   : record every received chunk with a nanosecond timestamp to file, see
+                      serial_capture.py to inspect or replay it; logparse reads it as log_type capture
+        --log       : append the received bytes to file
+        --flush     : how often the terminal and --log file are flushed in seconds (default 0.05)
+
+        serial_com.py -m <tty> [<tty> ...] [-b baudrate] [-r rtscts] [-e endline] [-o merged_log]
+
+        -m          : monitor many ports in one process (POSIX only). every line is printed as
+                      `<seconds since start> [<tty>] <line>` and appended to merged_log
+                      (default serial_mux_<date>_<time>.log). typed lines go to all ports,
+                      `@<tty> <line>` sends to one.
+
+        serial_com.py -l <tty> <command | @file> [-n count] [-x regex | -z terminator] [-w timeout]
+                      [-i interval] [-b baudrate] [-r rtscts] [-e endline]
+
+        -l          : send <command>, or each line of <file> in turn, count times (default 100) and print
+                      statistics and a histogram in microseconds of the time to the first response byte
+                      and to the response matching regex, or containing terminator (default \\n,
+                      backslash escapes allowed). -w is the per-command timeout in seconds (default 2),
+                      -i the pause between commands.
+
+        serial_com.py -s <tty> <script> [-n count] [-P depth] [-w timeout] [-b baudrate] [-r rtscts] [-e endline]
+
+        -s          : run the send/expect <script> count times (default 1) and print the time from each
+                      send to its response in milliseconds; see parse_script for the format. -P sends up to
+                      depth lines before their responses arrive (default 1: wait for each), -w is the
+                      default step timeout in seconds (default 2). exits with 1 if a run failed.
     """
 
-    if len(sys.argv) < 2:
+    argv = list(sys.argv)
+    if len(argv) > 1 and argv[1] == "-m":
+        monitor_main(argv)
+        return
+    if len(argv) > 1 and argv[1] == "-l":
+        latency_main(argv)
+        return
+    if len(argv) > 1 and argv[1] == "-s":
+        script_main(argv)
+        return
+    use_async = pop_flag(argv, "--async")
+    policy = pop_opt(argv, "--overflow", "block")
+    ring_size = int(pop_opt(argv, "--ring-size", RING_SIZE))
+    capture_path = pop_opt(argv, "--capture")
+    log_path = pop_opt(argv, "--log")
+    flush_interval = float(pop_opt(argv, "--flush", OUTPUT_FLUSH_INTERVAL))
+    if len(argv) < 2:
         print(USAGE)
         sys.exit(1)
 
-    tty = sys.argv[1]
-    baudrate = int(sys.argv[2]) if len(sys.argv) > 2 else 115200
-    rtscts = bool(int(sys.argv[3])) if len(sys.argv) > 3 else False
-    nl = sys.argv[4] if len(sys.argv) > 4 else "crlf"
-
-    cr = lf = True
-    if nl == "cr":
-        lf = False
-    elif nl == "lf":
-        cr = False
-    elif nl == "no_crlf":
-        cr = lf = False
-    elif nl != "crlf":
+    tty = argv[1]
+    baudrate = int(argv[2]) if len(argv) > 2 else 115200
+    rtscts = bool(int(argv[3])) if len(argv) > 3 else False
+    nl = argv[4] if len(argv) > 4 else "crlf"
+
+    endline = parse_endline(nl)
+    if endline is None:
         print("Invalid endline option")
         sys.exit(1)
+    cr, lf = endline
 
-    if sys.platform in ("linux", "darwin"):
-        tty = f"/dev/{tty}"
+    tty = device_path(tty)
+    capture = CaptureWriter(capture_path) if capture_path else None
+    log_fh = open(log_path, "ab") if log_path else None
+    ring = RingBuffer(ring_size, policy)
+    output = OutputWriter(ring, log_fh=log_fh, flush_interval=flush_interval)
+
+    if use_async:
+        print(f"Connected to {tty} @ {baudrate} (asyncio)")
+        print("Type commands, Ctrl+C to exit\n")
+        output.start()
+        try:
+            asyncio.run(console_async(tty, baudrate, rtscts, cr, lf, capture, output))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if capture is not None:
+                capture.close()
+            if log_fh is not None:
+                log_fh.close()
+        return
 
     ser = SerialPort(tty, baudrate, rtscts=rtscts)
     stop_event = threading.Event()
-
-    reader = SerialReader(ser, stop_event)
-    reader.start()
+    reader = SerialReader(ser, stop_event, ring, capture)
 
     print(f"Connected to {tty} @ {baudrate}")
     print("Type commands, Ctrl+C to exit\n")
+    reader.start()
+    output.start()
 
     try:
         while True:
@@ -124,10 +1168,18 @@ def main():
     except KeyboardInterrupt:
         pass
     finally:
-        stop_event.set()
+        reader.stop()
         reader.join(timeout=1)
+        output.join(timeout=1)
         ser.close()
+        if log_fh is not None:
+            log_fh.close()
         print("\nSerial port closed.")
+        print(reader.wake_summary())
+        print(ring.summary())
+        if capture is not None:
+            capture.close()
+            print(f"captured {capture.records} chunks, {capture.bytes} bytes to {capture_path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,262 @@
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+from logparse import latency_stats, pop_opt
+from serial_capture import open_pty, write_all
+from serial_com import RingBuffer, SerialPort, SerialReader, device_path
+
+
+FLOWS = ("none", "rtscts", "dsrdtr")
+PATTERN_SIZE = 65521
+PATTERN = random.Random(0).randbytes(PATTERN_SIZE)
+SYNC_SIZE = 16
+# the pattern followed by its start, so windows across the wrap are found too
+PATTERN_RING = PATTERN + PATTERN[:SYNC_SIZE]
+WINDOW = 4096
+DRAIN_TIMEOUT = 1.0
+
+USAGE = """
+Usage:
+
+    serial_com_bench.py <target> [-B bauds] [-F flows] [-C chunks] [-t seconds] [-w window]
+        write a fixed pseudo-random pattern into a loopback for <seconds> per combination of baud
+        rate, flow control and write size, read it back through serial_com's reader thread and
+        ring buffer, and print throughput, write-to-read latency with its jitter (stddev),
+        and bytes lost and bytes corrupted. The reader resynchronises on the pattern after
+        a mismatch, so a dropped byte counts as lost rather than corrupting the rest.
+
+ARGS:
+
+    target: where the data loops back, one of
+        pty        a pseudo-terminal pair, written on the master and read from the slave;
+                   baud rate and flow control have no effect.
+        loop://    pyserial's in-memory loopback (any pyserial URL works).
+        <tty>      one port with TX wired to RX (and RTS to CTS, DTR to DSR for flow control).
+        <tx>,<rx>  two ports wired to each other, written on <tx> and read on <rx>.
+    -B  comma separated baud rates (default 115200).
+    -F  comma separated flow control out of {} (default none).
+    -C  comma separated write sizes in bytes (default 1,64,1024).
+    -t  seconds of writing per combination (default 2).
+    -w  most bytes written ahead of the reader (default {}), so latency measures the path
+        rather than the OS buffers filling up.
+""".format(" | ".join(FLOWS), WINDOW)
+
+
+def pattern_at(offset, size):
+    """size bytes of the repeating pattern starting at stream offset."""
+    out = bytearray()
+    while len(out) < size:
+        start = (offset + len(out)) % PATTERN_SIZE
+        out += PATTERN[start:start + size - len(out)]
+    return bytes(out)
+
+
+class PatternChecker:
+    """
+    Follows the received stream through the pattern and tells lost bytes from corrupted ones.
+    After a mismatch it looks for the next SYNC_SIZE received bytes in the pattern: found
+    further on, the bytes skipped over were lost; not found, the mismatching byte was
+    corrupted and checking goes on one byte later. offset is the stream position the next
+    byte belongs to; bytes never received at the end are lost too, see lost_after().
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.received = 0
+        self.corrupted = 0
+        self.lost = 0
+        self._tail = b""
+
+    def feed(self, data):
+        self.received += len(data)
+        data = self._tail + data
+        self._tail = b""
+        pos = 0
+        while pos < len(data):
+            n = len(data) - pos
+            if data[pos:] == pattern_at(self.offset, n):
+                self.offset += n
+                return
+            want = pattern_at(self.offset, n)
+            i = next(i for i in range(n) if data[pos + i] != want[i])
+            self.offset += i
+            pos += i
+            if len(data) - pos < SYNC_SIZE:
+                self._tail = data[pos:]
+                return
+            self.resync(data[pos:pos + SYNC_SIZE])
+            if data[pos] == PATTERN[self.offset % PATTERN_SIZE]:
+                continue
+            self.corrupted += 1
+            self.offset += 1
+            pos += 1
+
+    def resync(self, window):
+        """Move offset to where window occurs in the pattern, within half a pattern either way."""
+        start = self.offset % PATTERN_SIZE
+        found = PATTERN_RING.find(window, start)
+        if found < 0:
+            found = PATTERN_RING.find(window)
+        if found < 0:
+            return
+        skip = (found - start) % PATTERN_SIZE
+        if skip > PATTERN_SIZE // 2:
+            # bytes inserted into the stream, already counted as corrupted
+            skip -= PATTERN_SIZE
+        self.offset += skip
+        self.lost += max(0, skip)
+
+    def finish(self):
+        """Check what is left of a stream that ended mid-resync byte by byte."""
+        tail, self._tail = self._tail, b""
+        want = pattern_at(self.offset, len(tail))
+        self.corrupted += sum(a != b for a, b in zip(tail, want))
+        self.offset += len(tail)
+
+    def lost_after(self, sent):
+        """Bytes lost out of sent in total: skipped mid-stream plus never received at the end."""
+        return self.lost + max(0, sent - self.offset)
+
+
+def open_loopback(target, baud, flow):
+    """Return (write function, SerialPort read back from, list of close functions)."""
+    if flow not in FLOWS:
+        raise ValueError("flow must be one of {}".format(FLOWS))
+    kw = {"rtscts": flow == "rtscts", "dsrdtr": flow == "dsrdtr"}
+    if target == "pty":
+        master, slave, path = open_pty()
+        rx = SerialPort(path, baud, **kw)
+        return lambda data: write_all(master, data), rx, [rx.close, lambda: os.close(master), lambda: os.close(slave)]
+    paths = [t if "://" in t else device_path(t) for t in target.split(",")]
+    if len(paths) == 1:
+        port = SerialPort(paths[0], baud, **kw)
+        return port.write, port, [port.close]
+    tx = SerialPort(paths[0], baud, **kw)
+    rx = SerialPort(paths[1], baud, **kw)
+    return tx.write, rx, [tx.close, rx.close]
+
+
+def run_config(target, baud, flow="none", chunk=1024, seconds=2.0, window=WINDOW):
+    """Push the pattern through target for seconds and return a dict of counts, timings and latencies in us."""
+    write, rx, closers = open_loopback(target, baud, flow)
+    ring = RingBuffer()
+    stop_event = threading.Event()
+    reader = SerialReader(rx, stop_event, ring)
+    sends = deque()
+    cond = threading.Condition()
+    checker = PatternChecker()
+    sent = done = 0
+    writing = True
+
+    def writer():
+        nonlocal sent, writing
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                with cond:
+                    while sent - done >= window and time.perf_counter() < deadline:
+                        cond.wait(0.1)
+                data = pattern_at(sent, min(chunk, window))
+                t = time.perf_counter_ns()
+                write(data)
+                sent += len(data)
+                sends.append((sent, t))
+        finally:
+            writing = False
+
+    latencies = []
+    reader.start()
+    t0 = time.perf_counter_ns()
+    last = t0
+    wt = threading.Thread(target=writer, daemon=True)
+    wt.start()
+    try:
+        # done is the stream position received up to, lost bytes included, so a loss
+        # neither stalls the writer nor shifts the latency of later writes
+        while writing or done < sent:
+            data = ring.drain(timeout=0.1)
+            now = time.perf_counter_ns()
+            if data:
+                checker.feed(data)
+                last = now
+                with cond:
+                    done = checker.offset
+                    cond.notify()
+                while sends and sends[0][0] <= done:
+                    latencies.append((now - sends.popleft()[1]) // 1000)
+            elif data is None or (not writing and now - last > DRAIN_TIMEOUT * 1e9):
+                break
+    finally:
+        reader.stop()
+        reader.join(timeout=1)
+        wt.join(timeout=1)
+        for close in closers:
+            close()
+    checker.finish()
+    secs = (last - t0) / 1e9
+    return {
+        "baud": baud,
+        "flow": flow,
+        "chunk": chunk,
+        "sent": sent,
+        "received": checker.received,
+        "lost": checker.lost_after(sent),
+        "corrupted": checker.corrupted,
+        "seconds": secs,
+        "throughput": checker.received / secs if secs else 0.0,
+        "latency": latency_stats(latencies),
+    }
+
+
+def sweep(target, bauds=(115200,), flows=("none",), chunks=(1, 64, 1024), seconds=2.0, window=WINDOW):
+    """run_config for every combination, yielding each result as it completes."""
+    for baud, flow, chunk in itertools.product(bauds, flows, chunks):
+        yield run_config(target, baud, flow, chunk, seconds, window)
+
+
+def format_header(target):
+    line_rate = target != "pty" and "://" not in target
+    return (f"{target}\n{'baud':>8} {'flow':>7} {'chunk':>6} {'sent':>10} {'lost':>7} {'corrupt':>7} "
+            f"{'KB/s':>9} {'line%' if line_rate else '':>6} {'p50 us':>9} {'p99 us':>9} {'jitter us':>10}")
+
+
+def format_result(target, r):
+    line_rate = target != "pty" and "://" not in target
+    lat = r["latency"]
+    # a UART frame is 10 bits: start, 8 data, stop
+    pct = f"{r['throughput'] / (r['baud'] / 10) * 100:.1f}" if line_rate else ""
+    if lat["count"]:
+        lat_cols = f"{lat['p50']:>9} {lat['p99']:>9} {lat['stddev']:>10.1f}"
+    else:
+        lat_cols = f"{'-':>9} {'-':>9} {'-':>10}"
+    return (f"{r['baud']:>8} {r['flow']:>7} {r['chunk']:>6} {r['sent']:>10} {r['lost']:>7} "
+            f"{r['corrupted']:>7} {r['throughput'] / 1024:>9.1f} {pct:>6} {lat_cols}")
+
+
+def main():
+    argv = list(sys.argv)
+    bauds = [int(b) for b in pop_opt(argv, "-B", "115200").split(",")]
+    flows = pop_opt(argv, "-F", "none").split(",")
+    chunks = [int(c) for c in pop_opt(argv, "-C", "1,64,1024").split(",")]
+    seconds = float(pop_opt(argv, "-t", 2))
+    window = int(pop_opt(argv, "-w", WINDOW))
+    if len(argv) != 2:
+        print(USAGE)
+        sys.exit(0)
+    target = argv[1]
+    print(format_header(target))
+    failed = False
+    for r in sweep(target, bauds, flows, chunks, seconds, window):
+        print(format_result(target, r), flush=True)
+        failed |= r["lost"] > 0 or r["corrupted"] > 0
+    return "FAIL: bytes lost or corrupted" if failed else "PASS"
+
+
+if __name__ == "__main__":
+    result = main()
+    print(result)
@@ -0,0 +1,81 @@
+import io
+import os
+
+import pytest
+
+import logparse
+
+
+LINE = "[2024-01-02 10:00:{:02d}.000 RX] {}\n"
+
+
+def write_log(path, lines, mode="w"):
+    with open(path, mode) as fh:
+        for i, msg in lines:
+            fh.write(LINE.format(i, msg))
+
+
+def cached(path, search_strs, log_type):
+    return logparse.cached_scan_events(str(path), search_strs, log_type)
+
+
+def test_cached_scan_tail_per_log_type(tmp_path, monkeypatch):
+    monkeypatch.setattr(logparse, "CACHE_DIR", str(tmp_path / "cache"))
+    log = tmp_path / "a.log"
+    write_log(log, [(0, "START"), (1, "END")])
+    for log_type in ("cutecom", "minicom"):
+        assert len(cached(log, ["START", "END"], log_type)["START"]) == 1
+    write_log(log, [(2, "START"), (3, "END")], "a")
+    # the cutecom query moves past the new tail, minicom must still parse it
+    assert len(cached(log, ["START", "END"], "cutecom")["START"]) == 2
+    assert len(cached(log, ["START", "END"], "minicom")["START"]) == 2
+    assert cached(log, ["START", "END"], "minicom") == logparse.scan_events(str(log), ["START", "END"], "minicom")
+
+
+def test_cached_scan_new_search_str_keeps_other_log_types(tmp_path, monkeypatch):
+    monkeypatch.setattr(logparse, "CACHE_DIR", str(tmp_path / "cache"))
+    log = tmp_path / "a.log"
+    write_log(log, [(0, "START"), (1, "END")])
+    cached(log, ["START"], "cutecom")
+    cached(log, ["START"], "minicom")
+    write_log(log, [(2, "START"), (3, "END")], "a")
+    # a new search string rescans cutecom from the start, minicom keeps its own offset
+    assert len(cached(log, ["START", "END"], "cutecom")["END"]) == 2
+    assert len(cached(log, ["START"], "minicom")["START"]) == 2
+
+
+def test_stream_chunks_match_mapped_bounds(monkeypatch):
+    # a tiny read block puts delimiters across block boundaries
+    monkeypatch.setattr(logparse, "BLOCK_SIZE", 3)
+    data = b"a==b\n==\n\n=c==" * 5
+    want = [(s, e, data[s:e]) for s, e in logparse.chunk_bounds(data, "==")]
+    assert list(logparse.stream_chunks(io.BytesIO(data), "==")) == want
+
+
+def test_find_in_capture(tmp_path):
+    from serial_capture import CaptureWriter
+    cap = tmp_path / "x.cap"
+    with CaptureWriter(str(cap)) as w:
+        w.write(b"CMD_START\r\nCMD_DO")
+        w.write(b"NE latency=12ms\r\n")
+    found = logparse.parse_log_datetime_latency(str(cap), "CMD_DONE", "capture")["CMD_DONE"]
+    assert [v["Latency"] for v in found.values()] == [["latency=12ms"]]
+
+
+def test_find_unknown_log_type(tmp_path):
+    log = tmp_path / "a.log"
+    write_log(log, [(0, "START")])
+    with pytest.raises(ValueError):
+        logparse.parse_log_datetime_latency(str(log), "START", "nope")
+
+
+def test_cached_scan_warm_hit_keeps_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(logparse, "CACHE_DIR", str(tmp_path / "cache"))
+    log = tmp_path / "a.log"
+    write_log(log, [(0, "START"), (1, "END")])
+    first = cached(log, ["START", "END"], "cutecom")
+    index = logparse.index_path(str(log))
+    before = os.stat(index).st_mtime_ns
+    os.utime(index, ns=(before - 10 ** 9, before - 10 ** 9))
+    assert cached(log, ["END", "START"], "cutecom") == first
+    assert os.stat(index).st_mtime_ns == before - 10 ** 9